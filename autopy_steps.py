@@ -0,0 +1,544 @@
+import glob
+import grp
+import json
+import os
+
+from framework import (
+    APT,
+    NETWORK,
+    SUDO,
+    step,
+    all_steps,
+    profile,
+    has_tag,
+    target,
+    logger,
+    bash,
+    home_path,
+    files_path,
+    configuration_path,
+    downloads_path,
+    code_path,
+    distribution_codename,
+    architecture,
+    user_name,
+    login_shell,
+    oh_my_zsh_path,
+    zsh_custom_path,
+    tool_path,
+    create_folder,
+    all_exist,
+    install_file,
+    file_is_current,
+    managed_block,
+    has_block,
+    block_is_current,
+    clone_git_repo,
+    clone_git_repos,
+    git_repo_path,
+    git_repo_is_current,
+    git_repos_are_current,
+    download,
+    download_all,
+    install_archive,
+    archive_is_current,
+    run_script,
+    apt_install,
+    apt_install_file,
+    is_installed,
+    mark_apt_sources_changed,
+    apt_repository,
+    is_repository_registered,
+    pip_packages,
+    go_packages,
+    flatpak_packages,
+    npm_packages,
+    install_extensions,
+    is_extension_installed,
+    zsh_startup_seconds,
+    startup_runs,
+    is_zcompiled,
+    zcompile,
+)
+
+# Every section is a step. Steps run in parallel as soon as the steps listed in 'after'
+# are done, and steps that 'use' the same resource (like APT) never run at the same time.
+# autopy.py and autopy-wsl2.py run the steps of their profile: the steps without tags and the ones whose tags are all in it.
+
+profile('desktop', ['desktop', 'k8s', 'dotnet', 'go'])
+profile('wsl2', ['wsl'])
+
+@step('Basic folders', check=lambda: all_exist(files_path, configuration_path, downloads_path, code_path))
+def basic_folders():
+    create_folder(files_path)
+    create_folder(configuration_path)
+    create_folder(downloads_path)
+    create_folder(code_path)
+
+
+# Tools needed to register the apt repositories below, before the batched install of every package runs
+repository_tools_packages = ['apt-transport-https', 'ca-certificates', 'curl', 'gnupg', 'lsb-release']
+
+@step('Repository tools', after=['Basic folders'], uses=[APT], inputs=repository_tools_packages, check=lambda: all(map(is_installed, repository_tools_packages)))
+def repository_tools():
+    apt_install(repository_tools_packages)
+
+
+# Packages from the default Ubuntu repositories
+apps = [
+    "git",
+    "htop",
+    "net-tools",
+    "jq",
+    "meld",
+    "zsh",
+    "make",
+    "fzf",
+    "unzip",
+    "python3-pip",
+    "python3-venv",
+    # fix this bug related to ubuntu jammy and python3.10: https://github.com/pre-commit/pre-commit/issues/2336 as recommended here: https://github.com/deadsnakes/python3.10-jammy
+    # Plot twist: ubuntu 24.04 don't like installing this package. Just avoiding it since I don't need python anymore
+    # "python3-distutils",
+    "libffi-dev", # needed for python to properly import _ctypes package. See: https://stackoverflow.com/a/48045929
+    "libpq-dev", # to install psycopg from source
+    "build-essential",  #
+    "zlib1g-dev",       #
+    "libssl-dev",       #
+    "libbz2-dev",       # A bunch of libs so that python can work properly
+    "libreadline-dev",  #
+    "libsqlite3-dev",   #
+    "liblzma-dev",      #
+    "postgresql-client",#
+    "tree",
+]
+
+@step('Built in packages', after=['Basic folders'], packages=apps)
+def built_in_packages():
+    pass
+
+
+# Pipx allows installing python tools in new versions of python, when the default distribution is externally managed
+@step('Pipx', after=['Basic folders'], packages=['pipx'], tags=['wsl'])
+def pipx():
+    pass
+
+
+postman_url = 'https://dl.pstmn.io/download/latest/linux64'
+
+# The URL always has the latest version, so the check asks the server if it changed since it was extracted
+@step('Postman', after=['Basic folders'], files=['postman/postman.desktop'], tags=['desktop'],
+      check=lambda: all_exist(f'{home_path}/.local/share/applications/postman.desktop') and archive_is_current(postman_url, configuration_path))
+def postman():
+    install_archive(postman_url, configuration_path, clean=f'{configuration_path}/Postman', refresh=True)
+    install_file('postman/postman.desktop', f'{home_path}/.local/share/applications/postman.desktop', template_vars={'POSTMANPATH': configuration_path})
+
+
+zshrc_files = ['zsh/.zshrc', 'zsh/zsh_conf.sh', 'zsh/alias.sh', 'zsh/git_alias.sh', 'zsh/docker_compose_alias.sh', 'zsh/ssh-agent.sh', 'zsh/wslutils.sh']
+wsl_zshrc_files = ['zsh/alias.sh', 'zsh/ssh-agent.sh', 'zsh/wslutils.sh']
+
+zshrc_path = os.path.join(home_path, '.zshrc')
+
+def profile_zshrc_files():
+    return [path for path in zshrc_files if has_tag('wsl') or path not in wsl_zshrc_files]
+
+def zshrc_content():
+    content = ''
+    for path in profile_zshrc_files():
+        with open(path, 'r') as f:
+            text = f.read()
+        content += text if text.endswith('\n') else f'{text}\n'
+    return content
+
+typewritten_url = 'https://github.com/reobin/typewritten.git'
+
+@step('ZSH', after=['Built in packages'], files=zshrc_files, needs=[NETWORK],
+      check=lambda: git_repo_is_current(typewritten_url, os.path.join(zsh_custom_path(), 'themes'))
+      and block_is_current(zshrc_path, 'zsh', zshrc_content()))
+def zsh():
+    # Makes zsh the default shell. The users of 'root:' targets are the ones of this machine, so they are left as they are
+    if target.can_sudo and login_shell() != tool_path('zsh'):
+        bash(f'sudo chsh -s {tool_path("zsh")} {user_name()}')
+    if not os.path.exists(oh_my_zsh_path()):
+        # using echo to respond 'no' when install script asks if I want to make zsh the default shell
+        run_script('https://raw.githubusercontent.com/ohmyzsh/ohmyzsh/master/tools/install.sh', 'echo n | sh {script}')
+    # Without the block, the .zshrc is the one oh my zsh installation writes (it keeps the previous one in .zshrc.pre-oh-my-zsh)
+    # or one written when the whole file was replaced on every run. Either way, ours replaces it
+    if os.path.exists(zshrc_path) and not has_block(zshrc_path, 'zsh'):
+        os.remove(zshrc_path)
+    managed_block(zshrc_path, 'zsh', zshrc_content())
+    # install custom theme
+    zsh_theme_path = os.path.join(zsh_custom_path(), 'themes')
+    clone_git_repo(typewritten_url, zsh_theme_path, depth=1, update=True)
+
+
+# Installing the .deb also registers the Microsoft repository the 'code' package is updated from
+@step('VS Code repository', after=['Basic folders'], uses=[APT], check=lambda: is_installed('code'), tags=['desktop'])
+def vs_code_repository():
+    vscode_deb_path, downloaded = download('https://go.microsoft.com/fwlink/?LinkID=760868', 'code_1.46.1-1592428892_amd64.deb')
+    if downloaded:
+        apt_install_file(vscode_deb_path)
+
+
+# VS Code extension ids can be found on the 'Identifier field'
+# of the extension page, at the bottom right corner
+vscode_extensions = [
+    ('Python', 'ms-python.python'),
+    ('Docker', 'ms-azuretools.vscode-docker'),
+    ('Terraform', 'hashicorp.terraform'),
+    ('Prisma', 'prisma.prisma'),
+    ('C#', 'ms-dotnettools.csharp'),
+    ('Go', 'golang.go')
+]
+
+@step('VS Code', after=['VS Code repository'], packages=['code'], files=['vscode/keybindings.json', 'vscode/settings.json'],
+      inputs=[extension[1] for extension in vscode_extensions], needs=[NETWORK], tags=['desktop'],
+      check=lambda: file_is_current('vscode/keybindings.json', f'{home_path}/.config/Code/User/keybindings.json')
+      and file_is_current('vscode/settings.json', f'{home_path}/.config/Code/User/settings.json')
+      and all(is_extension_installed(extension[1]) for extension in vscode_extensions))
+def vs_code():
+    install_extensions([extension[1] for extension in vscode_extensions])
+
+    install_file('vscode/keybindings.json', f'{home_path}/.config/Code/User/keybindings.json')
+    install_file('vscode/settings.json', f'{home_path}/.config/Code/User/settings.json')
+
+
+github_cli_key_url = 'https://cli.github.com/packages/githubcli-archive-keyring.gpg'
+
+@step('Github CLI repository', after=['Repository tools'], check=lambda: is_repository_registered('github-cli', key_url=github_cli_key_url), tags=['wsl'])
+def github_cli_repository():
+    apt_repository('github-cli', 'https://cli.github.com/packages stable main', key_url=github_cli_key_url)
+
+
+@step('Github CLI', after=['Github CLI repository'], packages=['gh'], tags=['wsl'])
+def github_cli():
+    pass
+
+
+docker_key_url = 'https://download.docker.com/linux/ubuntu/gpg'
+
+@step('Docker repository', after=['Repository tools'], check=lambda: is_repository_registered('docker', key_url=docker_key_url))
+def docker_repository():
+    # Instruction from https://docs.docker.com/engine/install/ubuntu/
+    apt_repository('docker', f'https://download.docker.com/linux/ubuntu {distribution_codename()} stable',
+                   key_url=docker_key_url, architectures=[architecture()])
+
+
+@step('Docker', after=['Docker repository'], packages=['docker-ce', 'docker-ce-cli', 'containerd.io', 'docker-compose-plugin'],
+      check=lambda: user_name() in grp.getgrnam('docker').gr_mem)
+def docker():
+    # Configure Docker to be run by non-root user
+    bash(f'sudo usermod -aG docker {user_name()}')
+
+
+@step('Flux', after=['Built in packages'], needs=[SUDO, NETWORK], check=lambda: all_exist('/usr/local/bin/flux'), tags=['k8s'])
+def flux():
+    if not all_exist('/usr/local/bin/flux'):
+        run_script('https://fluxcd.io/install.sh', 'sudo bash {script}')
+
+
+git_repo_urls = [
+    'git@github.com:daniellima/autopy.git',
+]
+desktop_git_repo_urls = [
+    'git@github.com:daniellima/awesome-links-generator.git',
+    'git@github.com:daniellima/snippets.git'
+]
+
+def profile_git_repo_urls():
+    return git_repo_urls + (desktop_git_repo_urls if has_tag('desktop') else [])
+
+@step('Git', after=['Built in packages'], inputs=git_repo_urls + desktop_git_repo_urls, files=['git/.gitconfig'], needs=[NETWORK],
+      check=lambda: file_is_current('git/.gitconfig', f'{home_path}/.gitconfig')
+      and git_repos_are_current(profile_git_repo_urls(), code_path))
+def git():
+    gitconfig_path = os.path.join(home_path, '.gitconfig')
+    install_file('git/.gitconfig', gitconfig_path)
+
+    # The repos are worked on, so they keep their history, without the old file contents until needed
+    clone_git_repos(profile_git_repo_urls(), code_path, filter='blob:none', update=True)
+
+
+# @step('XFCE 4')
+# def xfce_4():
+#     # Disable Xfce4 locking the screen after the VM is idle for sometime
+#     # It's not necessary, since the Host SO will ask for password in the lock screen after being idle for sometime
+#     # these next commands came from here: https://askubuntu.com/questions/259190/xubuntu-no-password-request-after-suspension
+#     bash('xfconf-query -c xfce4-session -p /shutdown/LockScreen -s false')
+#     bash('xfconf-query -c xfce4-power-manager -p /xfce4-power-manager/lock-screen-suspend-hibernate -s false')
+#     # disable screen saver lock screen
+#     # came from here: https://askubuntu.com/a/1263959
+#     bash('xfconf-query -c xfce4-screensaver -p /lock/enabled -s false')
+#     # Disable window dragging with alt+click')
+#     bash('xfconf-query -c xfwm4 -p /general/easy_click -s none')
+
+
+@step('Kubectl', after=['Basic folders'], tags=['k8s'],
+      check=lambda: all_exist('/usr/local/bin/kubectl', '/usr/local/bin/kubectx', '/usr/local/bin/kubens'))
+def kubectl():
+    (kubectl_path, _), (kubectx_path, _), (kubens_path, _) = download_all([
+        "https://dl.k8s.io/release/v1.29.2/bin/linux/amd64/kubectl",
+        "https://github.com/ahmetb/kubectx/raw/master/kubectx",
+        "https://github.com/ahmetb/kubectx/raw/master/kubens",
+    ])
+
+    install_file(kubectl_path, '/usr/local/bin/kubectl', mode=0o755)
+    install_file(kubectx_path, '/usr/local/bin/kubectx', mode=0o755)
+    install_file(kubens_path, '/usr/local/bin/kubens', mode=0o755)
+
+
+wslu_ppa_url = 'https://api.launchpad.net/1.0/~wslutilities/+archive/ubuntu/wslu'
+
+# Registered like the other repositories, with the key of the fingerprint Launchpad has for the PPA, instead of with
+# add-apt-repository: everything it needs then comes from download(), so bundles have it too
+@step('WSLU repository', after=['Repository tools'], inputs=[wslu_ppa_url], needs=[SUDO], tags=['wsl'], check=lambda: is_repository_registered('wslu'))
+def wslu_repository():
+    ppa_path, _ = download(wslu_ppa_url, 'wslu-ppa.json')
+    with open(ppa_path, 'r') as f:
+        fingerprint = json.load(f)['signing_key_fingerprint']
+    # The sources add-apt-repository wrote before would register the same repository twice
+    for path in glob.glob(target.path('/etc/apt/sources.list.d/wslutilities-ubuntu-wslu-*')):
+        bash(f'sudo rm {path}')
+    apt_repository('wslu', f'https://ppa.launchpadcontent.net/wslutilities/wslu/ubuntu {distribution_codename()} main', keyserver_id=fingerprint)
+
+
+@step('WSLU', after=['WSLU repository'], packages=['wslu'], tags=['wsl'])
+def wslu():
+    pass
+
+
+@step('AWS CLI', after=['Built in packages'], needs=[SUDO], check=lambda: all_exist('/usr/local/bin/aws'))
+def aws_cli():
+    awscli_installer_dir_path = os.path.join(downloads_path, 'aws')
+    awscli_unzipped_path = os.path.join(awscli_installer_dir_path, 'aws')
+    if not all_exist('/usr/local/bin/aws'):
+        install_archive('https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip', awscli_installer_dir_path, members=['aws'], clean=awscli_unzipped_path)
+        bash(f'sudo {awscli_unzipped_path}/install')
+
+
+# Apparently there is not a package to install just the redis-cli.
+# So, we install the server package and disable the server installation
+@step('Redis', after=['Basic folders'], packages=['redis-server'])
+def redis():
+    bash('sudo systemctl disable redis-server')
+    bash('sudo systemctl stop redis-server')
+
+
+mongo_db_key_url = 'https://www.mongodb.org/static/pgp/server-7.0.asc'
+
+@step('Mongo DB repository', after=['Repository tools'], check=lambda: is_repository_registered('mongodb-org-7.0', key_url=mongo_db_key_url))
+def mongo_db_repository():
+    # Instruction from https://www.mongodb.com/docs/v5.0/tutorial/install-mongodb-on-ubuntu/
+    apt_repository('mongodb-org-7.0', 'https://repo.mongodb.org/apt/ubuntu jammy/mongodb-org/7.0 multiverse',
+                   key_url=mongo_db_key_url, architectures=['amd64', 'arm64'])
+
+
+@step('Mongo DB', after=['Mongo DB repository'], packages=['mongodb-org'])
+def mongo_db():
+    pass
+
+
+@step('Node', after=['Built in packages'], needs=[NETWORK], check=lambda: all_exist(f'{home_path}/.nvm/nvm.sh') and glob.glob(f'{home_path}/.nvm/versions/node/*'))
+def node():
+    run_script('https://raw.githubusercontent.com/nvm-sh/nvm/v0.40.1/install.sh')
+    bash(npm_packages.command('nvm install --lts'))
+
+
+npm_tools = ['kafka-console', 'bull-repl']
+
+@step('Npm tools', after=['Node'], inputs=npm_tools, needs=[NETWORK], check=lambda: npm_packages.all_installed(npm_tools))
+def install_npm_tools():
+    npm_packages.install(npm_tools)
+
+
+@step('.NET repository', after=['Basic folders'], uses=[APT], check=lambda: is_installed('packages-microsoft-prod'), tags=['dotnet'])
+def dotnet_repository():
+    dotnet_deb_path, downloaded = download('https://packages.microsoft.com/config/ubuntu/20.04/packages-microsoft-prod.deb')
+    if downloaded:
+        bash(f'sudo dpkg -i {dotnet_deb_path}')
+        mark_apt_sources_changed()
+
+
+@step('.NET 6 SDK', after=['.NET repository'], packages=['dotnet-sdk-6.0'], tags=['dotnet'])
+def dotnet_6_sdk():
+    pass
+
+
+# DBeaver needs the GNOME runtime
+flatpak_apps = ['org.gnome.Platform//45', 'io.dbeaver.DBeaverCommunity', 'com.bitwarden.desktop']
+
+@step('Flatpak apps', after=['Basic folders'], inputs=flatpak_apps, needs=[NETWORK], tags=['desktop'], check=lambda: flatpak_packages.all_installed(flatpak_apps))
+def install_flatpak_apps():
+    flatpak_packages.install(flatpak_apps)
+
+
+@step('Download Go', after=['Basic folders'], check=lambda: all_exist('/usr/local/go/bin/go'), tags=['go'])
+def download_go():
+    install_archive('https://go.dev/dl/go1.20.2.linux-amd64.tar.gz', '/usr/local', clean='/usr/local/go')
+
+
+brave_browser_key_url = 'https://brave-browser-apt-release.s3.brave.com/brave-browser-archive-keyring.gpg'
+
+@step('Brave Browser repository', after=['Repository tools'], check=lambda: is_repository_registered('brave-browser-release', key_url=brave_browser_key_url), tags=['desktop'])
+def brave_browser_repository():
+    apt_repository('brave-browser-release', 'https://brave-browser-apt-release.s3.brave.com/ stable main',
+                   key_url=brave_browser_key_url, architectures=[architecture()])
+
+
+@step('Install Brave Browser', after=['Brave Browser repository'], packages=['brave-browser'], tags=['desktop'])
+def install_brave_browser():
+    pass
+
+
+tfenv_url = 'https://github.com/tfutils/tfenv.git'
+
+@step('Terraform', after=['Built in packages'], needs=[SUDO, NETWORK],
+      check=lambda: all_exist('/usr/local/bin/tfenv', '/usr/local/bin/terraform') and git_repo_is_current(tfenv_url, downloads_path))
+def terraform():
+    clone_git_repo(tfenv_url, downloads_path, depth=1, update=True)
+
+    tfenv_repository_path = os.path.join(downloads_path, 'tfenv')
+    if not all_exist('/usr/local/bin/tfenv'):
+        bash(f'sudo ln -s {tfenv_repository_path}/bin/tfenv /usr/local/bin')
+    if not all_exist('/usr/local/bin/terraform'):
+        bash(f'sudo ln -s {tfenv_repository_path}/bin/terraform /usr/local/bin')
+
+
+go_tools = [
+    'github.com/terraform-docs/terraform-docs@v0.16.0',
+    'sigs.k8s.io/kind@v0.16.0',
+    '-tags=postgres github.com/golang-migrate/migrate/v4/cmd/migrate@v4.15.2',
+]
+
+@step('Go tools', after=['Download Go'], inputs=go_tools, needs=[NETWORK], tags=['go'], check=lambda: go_packages.all_installed(go_tools))
+def install_go_tools():
+    go_packages.install(go_tools)
+
+
+pip_tools = ['pre-commit', 'aws2-wrap']
+
+@step('Pip tools', after=['Built in packages'], inputs=pip_tools, needs=[SUDO, NETWORK], tags=['desktop'], check=lambda: pip_packages.all_installed(pip_tools))
+def install_pip_tools():
+    pip_packages.install(pip_tools)
+
+
+@step('Install Terragrunt', after=['Basic folders'], check=lambda: all_exist('/usr/local/bin/terragrunt'))
+def install_terragrunt():
+    terragrunt_path, _ = download("https://github.com/gruntwork-io/terragrunt/releases/download/v0.48.4/terragrunt_linux_amd64")
+    install_file(terragrunt_path, '/usr/local/bin/terragrunt', mode=0o755)
+
+
+@step('Install kops', after=['Basic folders'], check=lambda: all_exist('/usr/local/bin/kops'))
+def install_kops():
+    kops_path, _ = download("https://github.com/kubernetes/kops/releases/download/v1.25.3/kops-linux-amd64")
+    install_file(kops_path, '/usr/local/bin/kops', mode=0o755)
+
+
+@step('K6 repository', after=['Repository tools'], check=lambda: is_repository_registered('k6'))
+def k6_repository():
+    apt_repository('k6', 'https://dl.k6.io/deb stable main', keyserver_id='C5AD17C747E3415A3642D57D77C6C491D6AC1D69')
+
+
+@step('Install K6', after=['K6 repository'], packages=['k6'])
+def install_k6():
+    pass
+
+
+@step('Install Tilt', after=['Built in packages'], needs=[SUDO, NETWORK], check=lambda: tool_path('tilt') is not None, tags=['k8s'])
+def install_tilt():
+    run_script('https://raw.githubusercontent.com/tilt-dev/tilt/master/scripts/install.sh')
+
+
+@step('Install Helm', after=['Basic folders'], check=lambda: all_exist('/usr/local/bin/helm'))
+def install_helm():
+    helm_binary_folder = f"{downloads_path}/helm-linux-x64"
+    install_archive('https://get.helm.sh/helm-v3.14.2-linux-amd64.tar.gz', helm_binary_folder, members=['linux-amd64/helm'])
+    install_file(f'{helm_binary_folder}/linux-amd64/helm', '/usr/local/bin/helm', mode=0o755)
+
+
+@step('Install mprocs', after=['Basic folders'], check=lambda: all_exist('/usr/local/bin/mprocs'))
+def install_mprocs():
+    mproc_binary_folder = f"{downloads_path}/mproc-linux-x64"
+    install_archive('https://github.com/pvolok/mprocs/releases/download/v0.6.4/mprocs-0.6.4-linux64.tar.gz', mproc_binary_folder, members=['mprocs'])
+    install_file(f'{mproc_binary_folder}/mprocs', '/usr/local/bin/mprocs', mode=0o755)
+
+
+hashicorp_key_url = 'https://apt.releases.hashicorp.com/gpg'
+
+@step('Hashicorp repository', after=['Repository tools'], check=lambda: is_repository_registered('hashicorp', key_url=hashicorp_key_url))
+def hashicorp_repository():
+    # Vault and Boundary come from the same repository, so it is configured only once
+    apt_repository('hashicorp', f'https://apt.releases.hashicorp.com {distribution_codename()} main', key_url=hashicorp_key_url)
+
+
+@step('Install Hashicorp Vault', after=['Hashicorp repository'], packages=['vault'])
+def install_hashicorp_vault():
+    pass
+
+
+@step('Install Hashicorp Boundary', after=['Hashicorp repository'], packages=['boundary=0.10.0-1'])
+def install_hashicorp_boundary():
+    pass
+
+
+@step('Install poetry', after=['Built in packages'], needs=[SUDO, NETWORK],
+      check=lambda: all_exist(f'{home_path}/.local/share/pypoetry/venv/bin/poetry', '/usr/local/bin/poetry'))
+def install_poetry():
+    run_script('https://install.python-poetry.org', 'python3 {script}')
+    if not all_exist('/usr/local/bin/poetry'):
+        bash('sudo ln -s ~/.local/share/pypoetry/venv/bin/poetry /usr/local/bin')
+
+    bash('poetry config virtualenvs.in-project true')
+
+
+pyenv_zshrc_lines = '''export PYENV_ROOT="$HOME/.pyenv"
+[[ -d $PYENV_ROOT/bin ]] && export PATH="$PYENV_ROOT/bin:$PATH"
+# 'pyenv init -' is slow, so its output is kept in a file that is generated again only when pyenv changes
+pyenv_init_path="$HOME/.cache/pyenv-init.zsh"
+if [[ ! -s $pyenv_init_path || $PYENV_ROOT/libexec/pyenv-init -nt $pyenv_init_path ]]; then
+    mkdir -p "${pyenv_init_path:h}" && pyenv init - zsh > "$pyenv_init_path" && zcompile "$pyenv_init_path"
+fi
+source "$pyenv_init_path"
+unset pyenv_init_path
+'''
+# What the block had before the output of 'pyenv init -' was cached. Only used to measure the difference
+uncached_pyenv_zshrc_lines = '''export PYENV_ROOT="$HOME/.pyenv"
+[[ -d $PYENV_ROOT/bin ]] && export PATH="$PYENV_ROOT/bin:$PATH"
+eval "$(pyenv init -)"
+'''
+
+# Adds its own block to the .zshrc that the ZSH step writes, so it must run after it
+@step('Pyenv', after=['ZSH'], needs=[NETWORK], check=lambda: all_exist(f'{home_path}/.pyenv') and block_is_current(zshrc_path, 'pyenv', pyenv_zshrc_lines))
+def pyenv():
+    if not os.path.exists(os.path.join(home_path, '.pyenv')):
+        run_script('https://pyenv.run')
+
+    managed_block(zshrc_path, 'pyenv', pyenv_zshrc_lines)
+
+
+# local.py can change anything configured above, so it only runs after every other step
+@step('Load local specific commands', after=all_steps())
+def load_local_specific_commands():
+    if not os.path.exists('local.py'):
+        bash('cp local.sample.py local.py')
+
+    exec(open('local.py').read(), globals())
+
+
+# Every new terminal pays for the .zshrc, so it is compiled whenever it changes. The startup time is reported
+# against the same .zshrc without the optimizations (not compiled and running 'pyenv init -' every time)
+# local.py can add its own lines to the .zshrc, so this runs after it
+@step('ZSH startup', after=['ZSH', 'Pyenv', 'Load local specific commands'], check=lambda: is_zcompiled(zshrc_path))
+def zsh_startup():
+    # The ZSH step is skipped in runs without network, and then there may be no .zshrc yet
+    if not os.path.exists(zshrc_path):
+        logger.info(f"There is no '{zshrc_path}' to compile")
+        return
+    with open(zshrc_path, 'r') as f:
+        zshrc_text = f.read()
+    unoptimized_text = zshrc_text.replace(pyenv_zshrc_lines, uncached_pyenv_zshrc_lines)
+    before = zsh_startup_seconds(unoptimized_text)
+    zcompile(zshrc_path)
+    after = zsh_startup_seconds()
+    if before is not None and after is not None:
+        logger.info(f'ZSH startup: {before * 1000:.0f}ms before, {after * 1000:.0f}ms after (median of {startup_runs} runs)')
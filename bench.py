@@ -0,0 +1,554 @@
+import argparse
+import functools
+import http.server
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+# Measures how long autopy takes to provision a machine, and to do nothing on a machine that is already
+# provisioned, without touching this machine. The scripts run in a mount namespace where /usr, /etc, /var and
+# /opt are overlays (so every write goes to a temporary folder), with HOME in the temporary folder too, downloads
+# served by a local HTTP server and apt-get, sudo, git, curl... replaced by shims that just wait a realistic time.
+
+repository_path = os.path.dirname(os.path.abspath(__file__))
+inside_variable = 'AUTOPY_BENCH_INSIDE'
+overlaid_folders = ['/usr', '/etc', '/var', '/opt']
+# Emptied inside the overlays, so what is installed on this machine doesn't make the steps skip work
+emptied_paths = ['/etc/apt/sources.list.d', '/usr/share/keyrings', '/usr/local/go', '/var/lib/flatpak', '/usr/local/bin']
+kept_in_local_bin = ('python', 'pip')
+
+binary_size = 8 * 1024 * 1024
+request_latency = 0.1
+bytes_per_second = 50 * 1024 * 1024
+
+# Seconds every shim waits, multiplied by --latency-scale
+latencies = {
+    'apt_update': 2.0,
+    'apt_install': 3.0,
+    'apt_install_per_package': 0.15,
+    # Packages that are not in apt's cache yet are downloaded first
+    'apt_download_per_package': 0.15,
+    # What 'apt-get install --download-only' takes besides the downloads (reading the lists and resolving dependencies)
+    'apt_resolve': 1.0,
+    'dpkg_install': 1.0,
+    'git_clone': 1.0,
+    'git': 0.2,
+    'flatpak_install': 3.0,
+    'flatpak_list': 0.3,
+    'code_install_extension': 1.5,
+    'code_list_extensions': 0.5,
+    'gpg': 0.1,
+    'curl': 0.3,
+    'pip_install': 2.0,
+    'go_install': 2.0,
+    'npm_install': 2.0,
+    'systemctl': 0.2,
+    'user_change': 0.1,
+    'zsh': 0.3,
+    'poetry': 0.3,
+}
+
+# Content served by the fake 'curl' and 'wget', by a piece of the URL. Install scripts create what the steps check for
+curl_responses = [
+    ('ohmyzsh', 'mkdir -p "$HOME/.oh-my-zsh/custom/themes" "$HOME/.oh-my-zsh/custom/plugins"'),
+    ('nvm-sh', 'mkdir -p "$HOME/.nvm" && echo \'nvm() { mkdir -p "$HOME/.nvm/versions/node/v20.0.0"; }\' > "$HOME/.nvm/nvm.sh"'),
+    ('pyenv.run', 'mkdir -p "$HOME/.pyenv/bin" "$HOME/.pyenv/shims"'),
+    ('tilt-dev', 'printf "#!/bin/sh\\n" > /usr/local/bin/tilt && chmod +x /usr/local/bin/tilt'),
+    ('fluxcd.io', 'printf "#!/bin/sh\\n" > /usr/local/bin/flux && chmod +x /usr/local/bin/flux'),
+    ('python-poetry', "import os; path = os.path.expanduser('~/.local/share/pypoetry/venv/bin'); os.makedirs(path, exist_ok=True); open(f'{path}/poetry', 'w').write('#!/bin/sh\\n'); os.chmod(f'{path}/poetry', 0o755)"),
+    ('', '-----BEGIN PGP PUBLIC KEY BLOCK-----\nbenchmark\n-----END PGP PUBLIC KEY BLOCK-----'),
+]
+
+# Like apt-get and dpkg, the shims that install take the dpkg lock, and fail at once when it is taken
+dpkg_lock = '''
+exec 9> /var/lib/dpkg/lock-frontend
+if ! flock -n 9; then
+    echo "E: Could not get lock /var/lib/dpkg/lock-frontend. It is held by another process" >&2
+    exit 100
+fi
+'''
+
+shims = {
+    'sudo': '''
+while [ "${{1#-}}" != "$1" ]; do
+    case $1 in -u|-g) shift ;; esac
+    shift
+done
+exec "$@"
+''',
+    'apt-get': '''
+case " $* " in
+*" update "*) sleep {apt_update} ;;
+*" install "*)
+    {dpkg_lock}
+    download_only=false
+    case " $* " in *" --download-only "*) download_only=true ;; esac
+    cache=/var/cache/apt/archives
+    for argument in "$@"; do
+        case $argument in Dir::Cache::archives=*) cache=${{argument#*=}} ;; esac
+    done
+    for argument in "$@"; do
+        case $argument in
+        -*|install|*/*) ;;
+        *)
+            name=${{argument%%=*}}
+            version=${{argument#*=}}
+            [ "$version" = "$argument" ] && version=1.0
+            if [ ! -e "$cache/bench-$name.deb" ]; then
+                mkdir -p "$cache" && touch "$cache/bench-$name.deb"
+                sleep {apt_download_per_package}
+            fi
+            $download_only && continue
+            sed -i "/^Package: $name$/,/^$/d" /var/lib/dpkg/status
+            printf 'Package: %s\\nStatus: install ok installed\\nVersion: %s\\n\\n' "$name" "$version" >> /var/lib/dpkg/status
+            sleep {apt_install_per_package}
+            ;;
+        esac
+    done
+    if $download_only; then sleep {apt_resolve}; else sleep {apt_install}; fi
+    ;;
+esac
+''',
+    'dpkg': '''
+case $1 in
+--print-architecture) echo amd64 ;;
+-i)
+    {dpkg_lock}
+    sleep {dpkg_install}
+    ;;
+esac
+''',
+    'git': '''
+if [ "$1" = clone ]; then
+    shift
+    arguments=""
+    for argument in "$@"; do
+        case $argument in -*) ;; *) arguments="$arguments $argument" ;; esac
+    done
+    set -- $arguments
+    folder=${{2:-$(basename "$1" .git)}}
+    mkdir -p "$folder/.git" "$folder/bin"
+    # tfenv is linked to /usr/local/bin from the clone
+    case $1 in *tfenv*) touch "$folder/bin/tfenv" "$folder/bin/terraform" ;; esac
+    sleep {git_clone}
+else
+    # Every clone is already at the last commit of its upstream. Only ls-remote asks the remote
+    case " $* " in
+    *" rev-parse "*) echo refs/remotes/origin/main ;;
+    *" merge-base "*) ;;
+    *" ls-remote "*) sleep {git}; printf '0123456789abcdef0123456789abcdef01234567\\trefs/heads/main\\n' ;;
+    *) sleep {git} ;;
+    esac
+fi
+''',
+    'flatpak': '''
+case $1 in
+install)
+    for argument in "$@"; do
+        case $argument in
+        -*|install|flathub) ;;
+        *//*) mkdir -p "/var/lib/flatpak/app/${{argument%%//*}}/${{argument##*//}}" ;;
+        *.*) mkdir -p "/var/lib/flatpak/app/$argument/stable" ;;
+        esac
+    done
+    sleep {flatpak_install}
+    ;;
+list)
+    for branch in /var/lib/flatpak/app/*/*; do
+        [ -d "$branch" ] && printf '%s\\t%s\\n' "$(basename "$(dirname "$branch")")" "$(basename "$branch")"
+    done
+    sleep {flatpak_list}
+    ;;
+esac
+''',
+    'code': '''
+extensions="$HOME/.bench-code-extensions"
+if [ "$1" = --list-extensions ]; then
+    cat "$extensions" 2>/dev/null
+    sleep {code_list_extensions}
+    exit 0
+fi
+while [ $# -gt 0 ]; do
+    if [ "$1" = --install-extension ]; then
+        echo "$2@1.0.0" >> "$extensions"
+        sleep {code_install_extension}
+        shift
+    fi
+    shift
+done
+''',
+    'gpg': '''
+output=""
+dearmor=false
+while [ $# -gt 0 ]; do
+    case $1 in
+    -o|--output) output=$2; shift ;;
+    --dearmor) dearmor=true ;;
+    --keyring) touch "$2"; shift ;;
+    esac
+    shift
+done
+if $dearmor; then
+    if [ -n "$output" ]; then cat > "$output"; else cat; fi
+fi
+sleep {gpg}
+''',
+    'curl': '''
+output=-
+url=""
+while [ $# -gt 0 ]; do
+    case $1 in
+    -o-) output=- ;;
+    -o) output=$2; shift ;;
+    --*) ;;
+    -*o) output=$2; shift ;;
+    http*) url=$1 ;;
+    esac
+    shift
+done
+sleep {curl}
+content=$(bench_curl_response "$url")
+if [ "$output" = - ]; then printf '%s\\n' "$content"; else printf '%s\\n' "$content" > "$output"; fi
+''',
+    'wget': '''
+for argument in "$@"; do
+    case $argument in http*) url=$argument ;; esac
+done
+sleep {curl}
+bench_curl_response "$url"
+''',
+    'pip3': '''
+packages="$HOME/.bench-pip-packages"
+if [ "$1" = list ]; then
+    printf '['
+    separator=""
+    while read -r name; do printf '%s{{"name": "%s", "version": "1.0.0"}}' "$separator" "$name"; separator=", "; done < <(cat "$packages" 2>/dev/null)
+    printf ']\\n'
+    exit 0
+fi
+for argument in "$@"; do
+    case $argument in -*|install) ;; *) printf '#!/bin/sh\\n' > "/usr/local/bin/$argument" && chmod +x "/usr/local/bin/$argument" && echo "$argument" >> "$packages" ;; esac
+done
+sleep {pip_install}
+''',
+    'go': '''
+if [ "$1" = install ]; then
+    tags=""
+    for argument in "$@"; do
+        case $argument in
+        -tags=*) tags=$argument ;;
+        *@*) package=${{argument%@*}}; version=${{argument##*@}}; name=${{package##*/}} ;;
+        esac
+    done
+    mkdir -p "$HOME/go/bin"
+    # What 'go version -m' reads from the binary
+    printf '#!/bin/sh\\n# path %s\\n# mod %s %s\\n' "$package" "$package" "$version" > "$HOME/go/bin/$name"
+    if [ -n "$tags" ]; then
+        printf '# build %s\\n' "$tags" >> "$HOME/go/bin/$name"
+    fi
+    chmod +x "$HOME/go/bin/$name"
+    sleep {go_install}
+elif [ "$1" = version ] && [ "$2" = -m ]; then
+    shift 2
+    for binary in "$@"; do
+        echo "$binary: go1.20.2"
+        sed -n 's/^# \\(path\\|mod\\|build\\) /\\t\\1\\t/p' "$binary" | sed 's/ /\\t/g'
+    done
+fi
+''',
+    'npm': '''
+packages="$HOME/.bench-npm-packages"
+case $1 in
+ls)
+    printf '{{"dependencies": {{'
+    separator=""
+    while read -r name; do printf '%s"%s": {{"version": "1.0.0"}}' "$separator" "$name"; separator=", "; done < <(cat "$packages" 2>/dev/null)
+    printf '}}}}\\n'
+    ;;
+install)
+    for argument in "$@"; do
+        case $argument in -*|install) ;; *) echo "$argument" >> "$packages" ;; esac
+    done
+    sleep {npm_install}
+    ;;
+esac
+''',
+    'systemctl': '''
+sleep {systemctl}
+''',
+    'usermod': '''
+group=""
+while [ $# -gt 1 ]; do
+    case $1 in -aG|-G) group=$2; shift ;; esac
+    shift
+done
+if [ -n "$group" ]; then
+    if grep -q "^$group:" /etc/group; then
+        sed -i "s/^\\($group:[^:]*:[^:]*:\\)\\(.*\\)$/\\1\\2,$1/; s/:,/:/" /etc/group
+    else
+        echo "$group:x:999:$1" >> /etc/group
+    fi
+fi
+sleep {user_change}
+''',
+    'chsh': '''
+sleep {user_change}
+''',
+    'lsb_release': '''
+echo jammy
+''',
+    'zsh': '''
+case "$*" in
+*zcompile*) arguments="$*"; touch "${{arguments##* }}.zwc" ;;
+*) echo "$HOME/.oh-my-zsh/custom" ;;
+esac
+sleep {zsh}
+''',
+    'poetry': '''
+sleep {poetry}
+''',
+}
+
+shims['apt'] = shims['apt-get']
+
+def _binary(name):
+    return random.Random(name).randbytes(binary_size)
+
+def _tar(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz', compresslevel=1) as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o755
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+def _zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, content in files.items():
+            info = zipfile.ZipInfo(name)
+            info.external_attr = 0o100755 << 16
+            archive.writestr(info, content)
+    return buffer.getvalue()
+
+fixtures_lock = threading.Lock()
+
+# Fixtures have the files the steps extract from the real artifacts. Anything else is served as a binary
+def fixture(url):
+    with fixtures_lock:
+        return _fixture(url)
+
+@functools.lru_cache(maxsize=None)
+def _fixture(url):
+    if 'helm-' in url:
+        return _tar({'linux-amd64/helm': _binary(url), 'linux-amd64/LICENSE': b'license\n'})
+    if 'mprocs' in url:
+        return _tar({'mprocs': _binary(url)})
+    if 'go.dev/dl/' in url:
+        return _tar({'go/bin/go': b'#!/bin/sh\nexec go "$@"\n', 'go/pkg/tool': _binary(url), 'go/VERSION': b'go1.20.2\n'})
+    if 'api.launchpad.net' in url:
+        return json.dumps({'signing_key_fingerprint': '0' * 40}).encode()
+    if 'pstmn.io' in url:
+        return _tar({'Postman/app/Postman': _binary(url), 'Postman/app/resources/app.asar': _binary(f'{url}/app')})
+    # Install scripts are downloaded by autopy itself now, not only by the curl shim
+    for pattern, content in curl_responses:
+        if pattern and pattern in url:
+            return f'{content}\n'.encode()
+    if url.endswith('.zip'):
+        install_script = b'#!/bin/sh\nmkdir -p /usr/local/bin && printf "#!/bin/sh\\n" > /usr/local/bin/aws && chmod +x /usr/local/bin/aws\n'
+        return _zip({'aws/install': install_script, 'aws/dist/aws': _binary(url)})
+    return _binary(url)
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    latency_scale = 1.0
+
+    def do_GET(self):
+        host, _, path = self.path.lstrip('/').partition('/')
+        content = fixture(f'https://{host}/{path}')
+        time.sleep(request_latency * self.latency_scale)
+        etag = f'"{len(content)}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        chunk_size = 1024 * 1024
+        for offset in range(0, len(content), chunk_size):
+            self.wfile.write(content[offset:offset + chunk_size])
+            time.sleep(chunk_size / bytes_per_second * self.latency_scale)
+
+    def log_message(self, format, *args):
+        pass
+
+def _write_shims(bin_path, latency_scale):
+    os.makedirs(bin_path)
+    scaled = {name: f'{seconds * latency_scale:.3f}' for name, seconds in latencies.items()}
+    responses = '\n'.join(f"    *{pattern}*) cat <<'BENCH_EOF'\n{content}\nBENCH_EOF\n    ;;" for pattern, content in curl_responses)
+    helpers = {
+        'bench_curl_response': f'case $1 in\n{responses}\nesac\n',
+        **{name: body.format(**scaled, dpkg_lock=dpkg_lock.strip()) for name, body in shims.items()},
+    }
+    for name, body in helpers.items():
+        path = os.path.join(bin_path, name)
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/bash\n{body.lstrip()}')
+        os.chmod(path, 0o755)
+    # The scripts pipe install scripts to 'python3', which has to be this interpreter and not a pyenv shim of the real HOME
+    os.symlink(sys.executable, os.path.join(bin_path, 'python3'))
+
+def _mount_overlays(root_path):
+    for folder in overlaid_folders:
+        if not os.path.isdir(folder):
+            continue
+        upper_path = os.path.join(root_path, folder.strip('/'), 'upper')
+        work_path = os.path.join(root_path, folder.strip('/'), 'work')
+        os.makedirs(upper_path)
+        os.makedirs(work_path)
+        options = f'lowerdir={folder},upperdir={upper_path},workdir={work_path}'
+        # 'userxattr' lets the overlay record deleted files from inside a user namespace (Linux 5.11+)
+        if subprocess.run(['mount', '-t', 'overlay', 'overlay', '-o', f'{options},userxattr', folder], stderr=subprocess.DEVNULL).returncode != 0:
+            subprocess.run(['mount', '-t', 'overlay', 'overlay', '-o', options, folder], check=True)
+
+    # Nothing is removed unless every overlay is there, so the real files can't be touched
+    with open('/proc/self/mounts', 'r') as f:
+        mounts = f.read()
+    for folder in overlaid_folders:
+        if os.path.isdir(folder) and f'overlay {folder} overlay' not in mounts:
+            raise SystemExit(f'{folder} is not an overlay. Stopping before changing anything')
+
+    for path in emptied_paths:
+        if not os.path.isdir(path):
+            continue
+        for entry in os.listdir(path):
+            if path == '/usr/local/bin' and entry.startswith(kept_in_local_bin):
+                continue
+            entry_path = os.path.join(path, entry)
+            if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+                shutil.rmtree(entry_path)
+            else:
+                os.remove(entry_path)
+        if path == '/usr/local/go':
+            os.rmdir(path)
+    os.makedirs('/var/lib/dpkg', exist_ok=True)
+    with open('/var/lib/dpkg/status', 'w'):
+        pass
+
+def _copy_repository(destination):
+    ignored = shutil.ignore_patterns('.git', '__pycache__', 'local.py', 'bench_output.txt')
+    shutil.copytree(repository_path, destination, ignore=ignored)
+
+def _run_script(script, repository_copy, environment, log_path):
+    started_at = time.monotonic()
+    with open(log_path, 'w') as log:
+        completed_process = subprocess.run([sys.executable, script], cwd=repository_copy, env=environment, stdout=log, stderr=subprocess.STDOUT)
+    duration = time.monotonic() - started_at
+
+    trace_path = os.path.join(environment['HOME'], 'configuration', 'autopy-trace.json')
+    try:
+        with open(trace_path, 'r') as f:
+            events = json.load(f)['traceEvents']
+        os.remove(trace_path)
+    except FileNotFoundError:
+        events = []
+    steps = [event for event in events if event.get('cat') == 'step']
+    return duration, completed_process.returncode, steps
+
+def _describe(name, duration, return_code, steps):
+    statuses = {}
+    for event in steps:
+        status = event['args']['status'] or 'running'
+        statuses[status] = statuses.get(status, 0) + 1
+    counts = ', '.join(f'{count} {status}' for status, count in sorted(statuses.items()))
+    failure = '' if return_code == 0 else f' FAILED with exit code {return_code}'
+    return f'{name:<14} {duration:>7.2f}s  ({len(steps)} steps: {counts}){failure}'
+
+def run_inside(args):
+    root_path = os.environ['AUTOPY_BENCH_ROOT']
+    _mount_overlays(os.path.join(root_path, 'root'))
+
+    home_path = os.path.join(root_path, 'home')
+    bin_path = os.path.join(root_path, 'bin')
+    repository_copy = os.path.join(root_path, 'repository')
+    os.makedirs(os.path.join(home_path, '.local', 'share', 'applications'))
+    os.makedirs(os.path.join(home_path, '.config', 'Code', 'User'))
+    _write_shims(bin_path, args.latency_scale)
+    _copy_repository(repository_copy)
+
+    FixtureHandler.latency_scale = args.latency_scale
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    environment = {
+        **os.environ,
+        'HOME': home_path,
+        'PATH': f"{bin_path}:/usr/local/bin:/usr/bin:/bin:/usr/sbin:/sbin",
+        'AUTOPY_MIRROR': f'http://127.0.0.1:{server.server_address[1]}',
+    }
+    environment.pop(inside_variable)
+
+    lines = [f'{args.script} benchmark (latency scale {args.latency_scale})']
+    runs = [('Cold run', 'cold')] + [(f'No-op rerun {number}' if args.reruns > 1 else 'No-op rerun', f'rerun-{number}') for number in range(1, args.reruns + 1)]
+    cold_steps = []
+    for name, log_name in runs:
+        log_path = os.path.join(root_path, f'{log_name}.log')
+        duration, return_code, steps = _run_script(args.script, repository_copy, environment, log_path)
+        lines.append(_describe(name, duration, return_code, steps))
+        print(lines[-1], flush=True)
+        if return_code != 0:
+            lines.append(f'    see {log_path}')
+        cold_steps = cold_steps or steps
+
+    lines.append('Slowest steps on the cold run:')
+    for event in sorted(cold_steps, key=lambda event: event['dur'], reverse=True)[:args.slowest]:
+        lines.append(f"    {event['name']:<30} {event['dur'] / 1_000_000:>7.2f}s  {event['args']['status']}")
+    server.shutdown()
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description='Times autopy on a throwaway copy of this machine')
+    parser.add_argument('--script', default='autopy.py', help='script to benchmark (default: autopy.py)')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='multiplies the time the fake commands and downloads take. Use 0 to measure only the overhead of autopy')
+    parser.add_argument('--reruns', type=int, default=1, help='how many no-op reruns to time after the cold run')
+    parser.add_argument('--slowest', type=int, default=10, help='how many of the slowest steps to show')
+    parser.add_argument('--output', default=os.path.join(repository_path, 'bench_output.txt'), help='where the report is saved')
+    parser.add_argument('--keep', action='store_true', help="don't remove the temporary folder, to look at the logs")
+    args = parser.parse_args()
+
+    if os.environ.get(inside_variable):
+        lines = run_inside(args)
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        print('\n'.join(lines[lines.index('Slowest steps on the cold run:'):]))
+        return
+
+    if shutil.which('unshare') is None:
+        sys.exit("The benchmark needs 'unshare' (util-linux) to create the mount namespace")
+    root_path = tempfile.mkdtemp(prefix='autopy-bench-')
+    try:
+        environment = {**os.environ, inside_variable: '1', 'AUTOPY_BENCH_ROOT': root_path}
+        completed_process = subprocess.run(['unshare', '--map-root-user', '--mount', '--', sys.executable, os.path.abspath(__file__), *sys.argv[1:]], env=environment)
+    finally:
+        if args.keep:
+            print(f"Logs and files of the benchmark are in '{root_path}'")
+        else:
+            shutil.rmtree(root_path, ignore_errors=True)
+    sys.exit(completed_process.returncode)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+from .log import logger, log_section
+from .profiler import profiler
+from .transports import target, transport_for
+from .shell import bash, shell_session
+from .paths import home_path, files_path, configuration_path, downloads_path, code_path, state_path, trace_path
+from .facts import distribution_codename, architecture, user_name, login_shell, oh_my_zsh_path, zsh_custom_path, tool_path
+from .files import create_folder, all_exist, install_file, write_file, file_is_current, managed_block, has_block, block_is_current
+from .git import clone_git_repo, clone_git_repos, git_repo_is_current, git_repo_path, git_repos_are_current
+from .downloads import download, download_all, download_if_changed, has_changed
+from .archives import install_archive, archive_is_current
+from .scripts import run_script
+from .apt import apt_install, apt_install_file, apt_prefetch, installed_packages, is_installed, mark_apt_sources_changed
+from .packages import pip_packages, go_packages, flatpak_packages, npm_packages
+from .zsh import zsh_startup_seconds, startup_runs, is_zcompiled, zcompile
+from .vscode import install_extensions, is_extension_installed
+from .repositories import apt_repository, is_repository_registered
+from .steps import APT, APT_PACKAGES, APT_PREFETCH, NETWORK, SUDO, step, all_steps, profile, has_tag, select_steps, run_steps
+from .plan import plan_steps
+from .fleet import run_fleet
+from .bundle import create_bundle, use_bundle
+from .cli import run
@@ -0,0 +1,144 @@
+import fnmatch
+import functools
+import os
+import shlex
+import threading
+
+from .log import logger
+from .paths import downloads_path
+from .shell import bash
+from .transports import target
+
+dpkg_status_path = '/var/lib/dpkg/status'
+# Where apt_prefetch() downloads packages to, and where apt_install(prefetched=True) takes them from. It is kept
+# with the other downloads, so the fleet runner and the bundles share it too
+prefetched_packages_path = os.path.join(downloads_path, 'debs')
+
+# Goes up when a source or a signing key changed, so the next install updates the package lists first.
+# Repositories added by several steps end up sharing a single 'apt-get update'. _listed_sources_version
+# is the version the package lists were last updated at
+_sources_version = 0
+_listed_sources_version = 0
+_sources_lock = threading.Lock()
+_update_lock = threading.Lock()
+
+# Options of every apt-get call. Empty unless the packages come from a bundle
+_apt_options = ''
+
+def mark_apt_sources_changed():
+    global _sources_version
+    with _sources_lock:
+        _sources_version += 1
+
+def sources_version():
+    return _sources_version
+
+def lists_are_current(version):
+    # True when the package lists already have every repository registered up to that sources_version()
+    return version <= _listed_sources_version
+
+def use_local_repository(source_list_path, source_parts_path, lists_path):
+    # apt-get sees only the repository of source_list_path (source_parts_path is an empty folder instead of
+    # /etc/apt/sources.list.d), with its package lists in lists_path instead of the ones of the system,
+    # so every package comes from there and nothing is downloaded
+    global _apt_options
+    _apt_options = (f' -o Dir::Etc::SourceList={source_list_path} -o Dir::Etc::SourceParts={source_parts_path}'
+                    f' -o Dir::State::Lists={lists_path}')
+    mark_apt_sources_changed()
+
+@functools.lru_cache(maxsize=None)
+def installed_packages():
+    # Reads dpkg's own database instead of asking apt or dpkg, so checking
+    # what is already installed doesn't start any process. Returns {package: version}
+    packages = {}
+    try:
+        with open(target.path(dpkg_status_path), 'r', encoding='utf-8', errors='replace') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return packages
+
+    for stanza in content.split('\n\n'):
+        fields = {}
+        for line in stanza.splitlines():
+            if line.startswith(('Package:', 'Status:', 'Version:')):
+                key, _, value = line.partition(':')
+                fields[key] = value.strip()
+        if fields.get('Status', '').endswith(' installed') and 'Package' in fields:
+            packages[fields['Package']] = fields.get('Version', '')
+    return packages
+
+def is_installed(package):
+    # Accepts the same 'name' or 'name=version' syntax apt-get install does, including '*' in the version
+    name, _, version = package.partition('=')
+    installed_version = installed_packages().get(name)
+    if installed_version is None:
+        return False
+    return not version or fnmatch.fnmatchcase(installed_version, version)
+
+def _prefetched_option():
+    os.makedirs(os.path.join(prefetched_packages_path, 'partial'), exist_ok=True)
+    return f' -o Dir::Cache::archives={prefetched_packages_path}'
+
+# Installs every package in a single apt-get transaction, so the package cache is read and the dependencies are
+# resolved only once. Packages can be pinned like 'boundary=0.10.0-1'. With prefetched=True, the packages
+# apt_prefetch() downloaded are only unpacked
+def apt_install(packages, prefetched=False):
+    packages = [package for package in dict.fromkeys(packages) if not is_installed(package)]
+    if not packages:
+        logger.info('All apt packages are already installed')
+        return
+
+    _update_if_sources_changed()
+    try:
+        _install(packages, _prefetched_option() if prefetched else '')
+        if prefetched:
+            # The folder is kept between runs, so the .deb files of versions newer ones replaced are removed
+            bash(f'sudo apt-get{_apt_options}{_prefetched_option()} autoclean', check=False)
+    finally:
+        installed_packages.cache_clear()
+
+def _update_if_sources_changed():
+    # Package lists can't be updated by two apt-get at the same time
+    global _listed_sources_version
+    with _update_lock:
+        version = _sources_version
+        if version != _listed_sources_version:
+            bash(f'sudo apt-get{_apt_options} update')
+            _listed_sources_version = version
+
+# Downloads the packages without installing them, so the install that comes later only unpacks them. Meant to run
+# while other steps work, for packages the lists already have (see lists_are_current()): it never updates the lists,
+# so the install still does the only update. It takes the dpkg lock like any install, so it needs the APT resource.
+# Packages that can't be downloaded yet are left to the install, so it never fails
+def apt_prefetch(packages):
+    packages = [package for package in dict.fromkeys(packages) if not is_installed(package)]
+    if not packages:
+        return
+    if bash(f'sudo apt-get{_apt_options}{_prefetched_option()} install --download-only -y {" ".join(packages)}', check=False).returncode != 0:
+        logger.info('> Could not download every package in advance. The install will download the rest')
+
+def _install(packages, options):
+    completed_process = bash(f'sudo apt-get{_apt_options}{options} install -y {" ".join(packages)}', check=False)
+    if completed_process.returncode == 0:
+        return
+
+    logger.info(f'> Installing all packages at once failed. Installing them one by one to find the ones failing')
+    logger.info(f'Stderr: \'{completed_process.stderr}\'')
+    failed_packages = []
+    for package in packages:
+        completed_process = bash(f'sudo apt-get{_apt_options}{options} install -y {package}', check=False)
+        if completed_process.returncode != 0:
+            logger.info(f'> Could not install {package}: \'{completed_process.stderr}\'')
+            failed_packages.append(package)
+    if not failed_packages:
+        return
+    logger.info(f'Packages that could not be installed: {", ".join(failed_packages)}')
+    exit(1)
+
+# Installs a downloaded .deb, with its dependencies coming from the same repositories apt_install uses
+def apt_install_file(deb_path):
+    _update_if_sources_changed()
+    try:
+        bash(f'sudo apt-get{_apt_options} install -y {shlex.quote(os.path.abspath(deb_path))}')
+    finally:
+        installed_packages.cache_clear()
@@ -0,0 +1,208 @@
+import hashlib
+import http.client
+import json
+import os
+import shlex
+import stat
+import subprocess
+import tarfile
+import time
+import zipfile
+
+from .downloads import download, download_if_changed, has_changed, max_attempts, open_url, release_connection, save_validators, transfer_slots
+from .log import logger
+from .paths import configuration_path
+from .profiler import profiler
+from .shell import bash
+from .transports import target
+
+# Where the list of files extracted from each archive is kept, to know when extracting it again is not needed
+archives_path = os.path.join(configuration_path, 'archives')
+
+class _CountingReader:
+    # File object over the HTTP response that counts the downloaded bytes while tarfile reads them
+    def __init__(self, response):
+        self.response = response
+
+    def read(self, size=-1):
+        chunk = self.response.read(size if size >= 0 else None)
+        profiler.add_downloaded_bytes(len(chunk))
+        return chunk
+
+def _manifest_path(from_url, destination):
+    key = hashlib.sha256(f'{from_url} {destination}'.encode()).hexdigest()[:32]
+    return os.path.join(archives_path, f'{key}.json')
+
+def _is_extracted(manifest_path, sha256):
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return False
+    if sha256 is not None and manifest.get('sha256') != sha256:
+        return False
+    destination = manifest['destination']
+    for name, size in manifest['files'].items():
+        try:
+            if os.path.getsize(os.path.join(destination, name)) != size:
+                return False
+        except OSError:
+            return False
+    return True
+
+def _wanted(name, members, strip):
+    while name.startswith('./'):
+        name = name[2:]
+    name = name.rstrip('/')
+    parts = name.split('/')
+    if len(parts) <= strip:
+        return None
+    if members is not None and not any(name == member or name.startswith(f'{member.rstrip("/")}/') for member in members):
+        return None
+    return '/'.join(parts[strip:])
+
+def _extract_tar(fileobj, destination, members, strip, stop_early):
+    # Reads the archive as a stream, so it is decompressed while the bytes arrive. When the destination is
+    # not writable, the wanted members are passed as an uncompressed tar to 'sudo tar' instead of a temporary folder
+    files = {}
+    writable = os.access(destination, os.W_OK)
+    process = None if writable else subprocess.Popen(['sudo', 'tar', '-xf', '-', '-C', destination], stdin=subprocess.PIPE)
+    sink = None if writable else tarfile.open(fileobj=process.stdin, mode='w|')
+    remaining = set(members or [])
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            name = _wanted(member.name, members, strip)
+            if not name:
+                continue
+            if not member.isdir():
+                remaining.discard(member.name.removeprefix('./'))
+            member.name = name
+            if member.islnk():
+                member.linkname = _wanted(member.linkname, None, strip) or member.linkname
+            if member.isfile():
+                files[name] = member.size
+            if sink is not None:
+                sink.addfile(member, archive.extractfile(member) if member.isfile() else None)
+            elif hasattr(tarfile, 'tar_filter'):
+                archive.extract(member, destination, filter='tar')
+            else:
+                archive.extract(member, destination)
+            # When only some files are wanted, the rest of the archive doesn't need to be read
+            if stop_early and members is not None and not remaining:
+                break
+    if sink is not None:
+        sink.close()
+        process.stdin.close()
+        if process.wait() != 0:
+            logger.info(f"> Could not extract to '{destination}' with sudo tar")
+            exit(1)
+    return files
+
+def _extract_zip(path, destination, members, strip):
+    files = {}
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = _wanted(info.filename, members, strip)
+            if not name:
+                continue
+            # The same members the 'tar' filter refuses, so nothing is written outside of the destination
+            if os.path.isabs(name) or '..' in name.split('/'):
+                logger.info(f"> Refusing to extract '{info.filename}' from '{path}' outside of '{destination}'")
+                exit(1)
+            target_path = os.path.join(destination, name)
+            if info.is_dir():
+                os.makedirs(target_path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            mode = info.external_attr >> 16
+            if stat.S_ISLNK(mode):
+                # Symbolic links are stored with the path they point to as their content
+                if os.path.lexists(target_path):
+                    os.remove(target_path)
+                os.symlink(archive.read(info).decode(), target_path)
+                continue
+            with archive.open(info) as source, open(target_path, 'wb') as target:
+                while chunk := source.read(1024 * 1024):
+                    target.write(chunk)
+            # zipfile doesn't restore permissions, like the executable bit of the installers
+            if stat.S_IMODE(mode):
+                os.chmod(target_path, stat.S_IMODE(mode))
+            files[name] = info.file_size
+    return files
+
+def _stream_tar(from_url, destination, members, strip):
+    for attempt in range(1, max_attempts + 1):
+        parts, connection, response, url = open_url(from_url, {})
+        if response.status != 200:
+            response.read()
+            release_connection(parts, connection, response)
+            logger.info(f'> An error happened while downloading: {from_url}')
+            logger.info(f'Status: {response.status} {response.reason} ({url})')
+            exit(1)
+        reader = _CountingReader(response)
+        try:
+            files = _extract_tar(reader, destination, members, strip, stop_early=True)
+        except (OSError, http.client.HTTPException, EOFError, tarfile.ReadError) as ex:
+            connection.close()
+            logger.info(f'Download of {from_url} was interrupted ({type(ex).__name__}: {ex}). Attempt {attempt} of {max_attempts}')
+            if attempt < max_attempts:
+                time.sleep(2 ** attempt)
+            continue
+        connection.close()
+        save_validators(from_url, response)
+        return files
+
+    logger.info(f'> Could not download {from_url}')
+    exit(1)
+
+# True when the files extracted from from_url are still there and the server says the archive didn't change
+# since then. Meant for the check of steps that install URLs like '.../latest'
+def archive_is_current(from_url, destination):
+    destination = target.path(destination)
+    return _is_extracted(_manifest_path(from_url, destination), None) and not has_changed(from_url)
+
+# Extracts the archive at from_url into destination, optionally only some 'members' (files or folders)
+# and removing the first 'strip' folders of their paths. The archive is extracted while it is downloaded,
+# unless cache=True keeps it in the downloads folder (zip files are always kept, since they can't be streamed).
+# With 'sha256' it is always kept too, so nothing is extracted before the whole archive is verified.
+# 'clean' is a path removed before extracting. Returns False, without downloading anything, when the files
+# extracted last time are all still there. With refresh=True, for URLs whose content moves, the server is also
+# asked (with a conditional request) if the archive changed since it was extracted.
+def install_archive(from_url, destination, members=None, strip=0, file_name=None, sha256=None, cache=False, clean=None, refresh=False):
+    destination = target.path(destination)
+    clean = None if clean is None else target.path(clean)
+    manifest_path = _manifest_path(from_url, destination)
+    if _is_extracted(manifest_path, sha256) and not (refresh and has_changed(from_url)):
+        logger.info(f"'{from_url}' is already extracted in '{destination}'")
+        return False
+
+    is_zip = (file_name or from_url).endswith('.zip')
+    archive_path = None
+    if cache or is_zip or sha256 is not None:
+        # Downloaded (and verified) before 'clean' removes what the last version extracted
+        if refresh and sha256 is None:
+            archive_path, _ = download_if_changed(from_url, file_name)
+        else:
+            archive_path, _ = download(from_url, file_name, sha256)
+
+    if clean is not None and os.path.exists(clean):
+        clean_path = shlex.quote(clean)
+        bash(f'rm -rf {clean_path}' if os.access(os.path.dirname(clean), os.W_OK) else f'sudo rm -rf {clean_path}')
+    if not os.path.exists(destination):
+        os.makedirs(destination)
+
+    logger.info(f"Extracting '{from_url}' into '{destination}'")
+    if archive_path is None:
+        with transfer_slots, profiler.span(from_url, 'download') as span:
+            files = _stream_tar(from_url, destination, members, strip)
+            span.status = 'done'
+    elif is_zip:
+        files = _extract_zip(archive_path, destination, members, strip)
+    else:
+        with open(archive_path, 'rb') as f:
+            files = _extract_tar(f, destination, members, strip, stop_early=True)
+
+    os.makedirs(archives_path, exist_ok=True)
+    with open(manifest_path, 'w') as f:
+        json.dump({'url': from_url, 'destination': destination, 'sha256': sha256, 'files': files}, f)
+    return True
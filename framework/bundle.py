@@ -0,0 +1,208 @@
+import glob
+import hashlib
+import http.server
+import io
+import json
+import os
+import shlex
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+from . import downloads
+from .apt import use_local_repository
+from .archives import archives_path
+from .downloads import download, mirror_path, read_text, recorded_sha256
+from .files import hash_file
+from .log import logger
+from .paths import configuration_path, downloads_path
+from .shell import bash
+from .steps import APT, NETWORK, unavailable
+
+# A bundle is a tar with everything a profile downloads: the files of download(), download_if_changed() and
+# run_script(), the archives install_archive() extracts, and the .deb files of its apt packages with everything
+# they depend on. 'index.json' (the first member) maps every URL to its file, and the .deb files are a local
+# apt repository. With --from-bundle the steps get all of them from the bundle, with no network.
+index_name = 'index.json'
+debs_folder = 'debs'
+files_folder = 'files'
+# Where the bundle being used is extracted
+bundle_extract_path = os.path.join(configuration_path, 'bundle')
+
+def _apt_packages(steps):
+    # The packages steps declare, and the ones of steps that run apt themselves (listed in their inputs,
+    # like 'Repository tools'). Pinned versions like 'boundary=0.10.0-1' are kept
+    packages = []
+    for current in steps.values():
+        packages += current.packages
+        if APT in current.uses:
+            packages += [item for item in current.inputs if isinstance(item, str)]
+    return list(dict.fromkeys(packages))
+
+def _dependency_closure(packages):
+    # Every package needed to install them on a machine that has none of them yet, with every alternative of a
+    # dependency and every package providing a virtual one, so the machine can pick the same ones apt picks here
+    names = ' '.join(shlex.quote(package.partition('=')[0]) for package in packages)
+    output = bash(f'apt-cache depends --recurse --no-recommends --no-suggests --no-conflicts --no-breaks'
+                  f' --no-replaces --no-enhances {names}', capture=True).stdout
+    # Package names start the lines. Virtual packages, between '<>', are provided by others already in the list
+    closure = {line.strip() for line in output.splitlines() if line.strip() and not line.startswith((' ', '<'))}
+    pinned = [package for package in packages if '=' in package]
+    return sorted(closure - {package.partition('=')[0] for package in pinned}) + pinned
+
+def _download_debs(packages, debs_path):
+    # 'apt-get download' fetches each package as it is, without resolving them together like an install would,
+    # so alternatives that conflict with each other can be in the same bundle. It needs neither root nor the dpkg lock
+    os.makedirs(debs_path, exist_ok=True)
+    bash(f'cd {shlex.quote(debs_path)} && apt-get download'
+         f' {" ".join(shlex.quote(package) for package in _dependency_closure(packages))}')
+
+def _write_repository_index(debs_path):
+    # The same 'Packages' and 'Release' files 'dpkg-scanpackages' and 'apt-ftparchive' write for a flat repository
+    output = bash(f'cd {shlex.quote(debs_path)} && for deb in *.deb; do dpkg-deb -f "$deb"; echo "Filename: ./$deb"; echo; done',
+                  capture=True).stdout
+    stanzas = []
+    for stanza in output.split('\n\n'):
+        if not stanza.strip():
+            continue
+        file_name = stanza.rsplit('Filename: ./', 1)[1].strip()
+        deb_path = os.path.join(debs_path, file_name)
+        stanzas.append(f'{stanza.strip()}\nSize: {os.path.getsize(deb_path)}\nSHA256: {hash_file(deb_path).hexdigest()}\n')
+    packages_text = '\n'.join(stanzas).encode()
+    with open(os.path.join(debs_path, 'Packages'), 'wb') as f:
+        f.write(packages_text)
+    with open(os.path.join(debs_path, 'Release'), 'w') as f:
+        f.write(f"Origin: autopy\nLabel: autopy bundle\nDate: {time.strftime('%a, %d %b %Y %H:%M:%S UTC', time.gmtime())}\n"
+                f'SHA256:\n {hashlib.sha256(packages_text).hexdigest()} {len(packages_text)} Packages\n')
+
+def _downloaded_files():
+    # {url: path} of every file in the downloads folder, from the '<file>.url' saved next to them
+    files = {}
+    for url_path in glob.glob(os.path.join(downloads_path, '*.url')):
+        path = url_path.removesuffix('.url')
+        if os.path.exists(path):
+            files[read_text(url_path)] = path
+    return files
+
+def _extracted_archive_urls():
+    # install_archive() streams most archives instead of keeping them, but its manifests have their URLs
+    urls = []
+    for manifest_path in glob.glob(os.path.join(archives_path, '*.json')):
+        with open(manifest_path, 'r') as f:
+            urls.append(json.load(f)['url'])
+    return urls
+
+# Packs what the steps downloaded on this machine, so it has to be run after they ran here (with the same profile).
+# Archives that were extracted without being kept are downloaded again, and the .deb files come from apt
+def create_bundle(bundle_path, steps):
+    started_at = time.monotonic()
+    files = _downloaded_files()
+    missing_urls = [url for url in dict.fromkeys(_extracted_archive_urls()) if url not in files]
+    for url in missing_urls:
+        file_name = f"{hashlib.sha256(url.encode()).hexdigest()[:12]}-{os.path.basename(url.split('?')[0]) or 'index'}"
+        files[url], _ = download(url, file_name)
+    if not files:
+        logger.info('> Nothing was downloaded on this machine yet. Run the steps before bundling what they download')
+        exit(1)
+
+    with tempfile.TemporaryDirectory() as temporary_path:
+        debs_path = os.path.join(temporary_path, debs_folder)
+        packages = _apt_packages(steps)
+        if packages:
+            _download_debs(packages, debs_path)
+            _write_repository_index(debs_path)
+
+        index = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'steps': list(steps), 'packages': packages, 'files': {}}
+        for url, path in sorted(files.items()):
+            index['files'][mirror_path(url)] = {'url': url, 'name': f'{files_folder}/{os.path.basename(path)}',
+                                                'sha256': recorded_sha256(path), 'size': os.path.getsize(path)}
+
+        # Not compressed: what is in it already is, and unpacking it is then as fast as the disk
+        with tarfile.open(f'{bundle_path}.part', 'w') as bundle:
+            index_bytes = json.dumps(index, indent=2).encode()
+            index_info = tarfile.TarInfo(index_name)
+            index_info.size = len(index_bytes)
+            index_info.mtime = int(time.time())
+            bundle.addfile(index_info, io.BytesIO(index_bytes))
+            for item in index['files'].values():
+                bundle.add(files[item['url']], item['name'])
+            if packages:
+                bundle.add(debs_path, debs_folder)
+        os.replace(f'{bundle_path}.part', bundle_path)
+
+    logger.info(f"Bundled {len(index['files'])} files and {len(packages)} apt packages (with their dependencies) in "
+                f"'{bundle_path}' ({os.path.getsize(bundle_path) / 1024 / 1024:.1f}MB in {time.monotonic() - started_at:.1f}s)")
+
+def _read_index(bundle_path):
+    with tarfile.open(bundle_path, 'r') as bundle:
+        member = bundle.next()
+        if member is None or member.name != index_name:
+            logger.info(f"> '{bundle_path}' is not an autopy bundle")
+            exit(1)
+        return json.load(bundle.extractfile(member))
+
+class BundleHandler(http.server.BaseHTTPRequestHandler):
+    # Serves the files of the bundle at their mirror path, like '/github.com/...', answering
+    # conditional requests by sha256. URLs that are not in the bundle are 404, never asked to the internet
+    files = {}
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        item = self.files.get(self.path)
+        if item is None:
+            logger.info(f"> '{self.path}' is not in the bundle")
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = f'"{item["sha256"]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(item['size']))
+        self.end_headers()
+        with open(os.path.join(bundle_extract_path, item['name']), 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+
+    def log_message(self, format, *args):
+        pass
+
+# Makes every download of this run come from the bundle, and apt install only the packages in it
+def use_bundle(bundle_path):
+    index = _read_index(bundle_path)
+    extracted_index_path = os.path.join(bundle_extract_path, index_name)
+    if read_text(extracted_index_path) != json.dumps(index, indent=2):
+        logger.info(f"Extracting '{bundle_path}' into '{bundle_extract_path}'")
+        shutil.rmtree(bundle_extract_path, ignore_errors=True)
+        os.makedirs(bundle_extract_path)
+        with tarfile.open(bundle_path, 'r') as bundle:
+            if hasattr(tarfile, 'tar_filter'):
+                bundle.extractall(bundle_extract_path, filter='tar')
+            else:
+                bundle.extractall(bundle_extract_path)
+
+    BundleHandler.files = index['files']
+    unavailable[NETWORK] = "downloads on its own, which a bundle can't serve"
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), BundleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    downloads.mirror_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    if index['packages']:
+        debs_path = os.path.join(bundle_extract_path, debs_folder)
+        # apt-get update removes what it doesn't know from the lists folder, so the sources are kept in another one
+        lists_path = os.path.join(bundle_extract_path, 'lists')
+        sources_path = os.path.join(bundle_extract_path, 'sources')
+        os.makedirs(os.path.join(lists_path, 'partial'), exist_ok=True)
+        os.makedirs(os.path.join(sources_path, 'parts'), exist_ok=True)
+        source_list_path = os.path.join(sources_path, 'bundle.list')
+        with open(source_list_path, 'w') as f:
+            f.write(f'deb [trusted=yes] file:{debs_path} ./\n')
+        use_local_repository(source_list_path, os.path.join(sources_path, 'parts'), lists_path)
+    logger.info(f"Using the bundle created on {index['created']}: {len(index['files'])} files and {len(index['packages'])} apt packages")
@@ -0,0 +1,52 @@
+import argparse
+
+from .bundle import create_bundle, use_bundle
+from .fleet import default_max_parallel, run_fleet
+from .plan import plan_steps
+from .steps import profiles, run_steps, select_steps
+
+def run(profile=None):
+    parser = argparse.ArgumentParser(description='Configures this machine')
+    parser.add_argument('--profile', default=profile, choices=sorted(profiles) or None,
+                        help=f'which machine is being configured (default: {profile})')
+    parser.add_argument('--only', metavar='STEPS', action='append', default=[],
+                        help="run only these comma separated steps (like 'kubectl,helm', or a tag like 'k8s') and the steps they depend on")
+    parser.add_argument('--force', metavar='STEPS', action='append', default=[],
+                        help='run these comma separated steps (names, short names or tags, like --only) even if they are up to date. '
+                             'Can be used more than once')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='run every step, ignoring what the last runs recorded')
+    parser.add_argument('--plan', action='store_true',
+                        help="show which steps would run and why, without changing anything")
+    parser.add_argument('--target', metavar='TARGET', action='append', default=[],
+                        help="configure TARGET instead of this machine: 'local', 'root:<folder>', 'chroot:<folder>' or "
+                             "'ssh:[user@]host[:port]'. Can be used more than once, to configure a fleet of machines")
+    parser.add_argument('--parallel', metavar='N', type=int, default=default_max_parallel,
+                        help=f'how many targets are configured at the same time (default: {default_max_parallel})')
+    parser.add_argument('--bundle', metavar='FILE',
+                        help='pack everything the steps downloaded on this machine (files, archives, install scripts and the apt '
+                             'packages with their dependencies) in FILE, to configure other machines without network')
+    parser.add_argument('--from-bundle', metavar='FILE',
+                        help='get every download and apt package from a bundle made with --bundle, instead of the network')
+    args = parser.parse_args()
+
+    if args.target:
+        arguments = ['--profile', args.profile] if args.profile else []
+        arguments += [f'--only={value}' for value in args.only] + [f'--force={value}' for value in args.force]
+        arguments += ['--no-cache'] * args.no_cache + ['--plan'] * args.plan
+        if run_fleet(args.target, arguments, args.parallel):
+            exit(1)
+        return
+
+    only = [item for value in args.only for item in value.split(',') if item.strip()]
+    steps = select_steps(args.profile, only)
+    if args.bundle:
+        create_bundle(args.bundle, steps)
+        return
+    if args.from_bundle:
+        use_bundle(args.from_bundle)
+    if args.plan:
+        plan_steps(steps)
+        return
+    force = [item for value in args.force for item in value.split(',') if item.strip()]
+    run_steps(steps, force=force, use_cache=not args.no_cache)
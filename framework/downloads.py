@@ -0,0 +1,342 @@
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+from .files import hash_file
+from .log import logger
+from .paths import downloads_path, http_cache_path
+from .profiler import profiler
+
+# How many files can be transferred at the same time, counting every step that is downloading
+max_concurrent_downloads = int(os.environ.get('AUTOPY_MAX_DOWNLOADS', '4'))
+# Base URL of a server with the same files, requested as '<mirror>/<host>/<path>' instead of the original URL.
+# Used by bench.py to serve fixtures, but works with any local cache of the downloads
+mirror_url = os.environ.get('AUTOPY_MIRROR')
+max_redirects = 10
+max_attempts = 4
+chunk_size = 1024 * 1024
+timeout_seconds = 60
+
+class ConnectionPool:
+    # Keeps idle keep-alive connections per host, so the redirects and downloads
+    # that hit the same host (github.com, dl.k8s.io...) don't pay a new TLS handshake every time
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, host):
+        with self._lock:
+            connections = self._idle.get((scheme, host))
+            if connections:
+                return connections.pop(), True
+        connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return connection_class(host, timeout=timeout_seconds), False
+
+    def put(self, scheme, host, connection):
+        with self._lock:
+            self._idle.setdefault((scheme, host), []).append(connection)
+
+connection_pool = ConnectionPool()
+transfer_slots = threading.BoundedSemaphore(max_concurrent_downloads)
+_http_cache_lock = threading.Lock()
+
+def _request(url, headers):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += f'?{parts.query}'
+    headers = {'User-Agent': 'autopy', **headers}
+
+    connection, reused = connection_pool.get(parts.scheme, parts.netloc)
+    try:
+        connection.request('GET', path, headers=headers)
+        return parts, connection, connection.getresponse()
+    except (http.client.RemoteDisconnected, ConnectionError):
+        connection.close()
+        if not reused:
+            raise
+        # The server closed the idle connection while it was in the pool. Try again with a new one
+        connection, _ = connection_pool.get(parts.scheme, parts.netloc)
+        connection.request('GET', path, headers=headers)
+        return parts, connection, connection.getresponse()
+
+def release_connection(parts, connection, response):
+    if response.will_close:
+        connection.close()
+    else:
+        connection_pool.put(parts.scheme, parts.netloc, connection)
+
+def mirror_path(url):
+    # '/<host>/<path>', the path of url in a mirror
+    parts = urlsplit(url)
+    query = f'?{parts.query}' if parts.query else ''
+    return f"/{parts.netloc}{parts.path or '/'}{query}"
+
+def _mirrored(url):
+    if not mirror_url:
+        return url
+    return f"{mirror_url.rstrip('/')}{mirror_path(url)}"
+
+def open_url(from_url, headers):
+    url = _mirrored(from_url)
+    for _ in range(max_redirects + 1):
+        parts, connection, response = _request(url, headers)
+        if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+            response.read()
+            release_connection(parts, connection, response)
+            url = urljoin(url, response.getheader('Location'))
+            continue
+        return parts, connection, response, url
+
+    logger.info(f'> Too many redirects while downloading: {from_url}')
+    exit(1)
+
+def read_text(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def write_text(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+def _remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _read_http_cache():
+    try:
+        with open(http_cache_path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_validators(from_url, response):
+    etag = response.getheader('ETag')
+    last_modified = response.getheader('Last-Modified')
+    with _http_cache_lock:
+        cache = _read_http_cache()
+        if etag or last_modified:
+            cache[from_url] = {'etag': etag, 'last_modified': last_modified}
+        else:
+            cache.pop(from_url, None)
+        os.makedirs(os.path.dirname(http_cache_path), exist_ok=True)
+        with open(f'{http_cache_path}.tmp', 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(f'{http_cache_path}.tmp', http_cache_path)
+
+def _conditional_headers(from_url):
+    with _http_cache_lock:
+        validators = _read_http_cache().get(from_url, {})
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+# Asks the server, with the ETag / Last-Modified of the last download, if from_url changed. Without
+# them there is no way to know, so it is considered changed. Only reads, so it can be used in checks
+def has_changed(from_url):
+    headers = _conditional_headers(from_url)
+    if not headers:
+        return True
+    try:
+        parts, connection, response, url = open_url(from_url, headers)
+    except (OSError, http.client.HTTPException):
+        return True
+    if response.status != 304:
+        # The body is not needed, so the connection is closed instead of reading it
+        connection.close()
+        return True
+    response.read()
+    release_connection(parts, connection, response)
+    return False
+
+def _transfer(from_url, part_path, validator_path):
+    # Continues the part file from where the last attempt stopped. 'If-Range' makes the server
+    # send the whole file again, instead of the rest of it, when it changed since the part file was started
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = read_text(validator_path) if offset else None
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if validator else {}
+
+    parts, connection, response, url = open_url(from_url, headers)
+    if response.status == 206 and response.getheader('Content-Range', '').startswith(f'bytes {offset}-'):
+        logger.info(f'Resuming {from_url} from byte {offset}')
+    elif response.status == 200:
+        offset = 0
+        validator = response.getheader('ETag') or response.getheader('Last-Modified')
+        if validator and validator.startswith('W/'):
+            validator = response.getheader('Last-Modified')
+        _remove(validator_path)
+        if validator:
+            write_text(validator_path, validator)
+    elif response.status in (206, 416):
+        # The server doesn't agree with what is in the part file. Start over on the next attempt
+        response.read()
+        release_connection(parts, connection, response)
+        _remove(part_path, validator_path)
+        raise http.client.HTTPException(f'Unexpected {response.status} response when resuming')
+    else:
+        response.read()
+        release_connection(parts, connection, response)
+        logger.info(f'> An error happened while downloading: {from_url}')
+        logger.info(f'Status: {response.status} {response.reason} ({url})')
+        exit(1)
+
+    # The hash is computed while bytes arrive, so verifying it doesn't need another pass over the file.
+    # Only the bytes kept from an interrupted attempt are read again
+    digest = hash_file(part_path) if offset else hashlib.sha256()
+    content_length = response.getheader('Content-Length')
+    expected_size = offset + int(content_length) if content_length else None
+    try:
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            while chunk := response.read(chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+                profiler.add_downloaded_bytes(len(chunk))
+            size = f.tell()
+    except BaseException:
+        connection.close()
+        raise
+    release_connection(parts, connection, response)
+
+    if expected_size is not None and size != expected_size:
+        raise http.client.IncompleteRead(b'', expected_size - size)
+    return digest.hexdigest(), offset > 0
+
+def _fetch(from_url, download_file_path, sha256):
+    part_path = f'{download_file_path}.part'
+    validator_path = f'{part_path}.validator'
+    for attempt in range(1, max_attempts + 1):
+        try:
+            digest, resumed = _transfer(from_url, part_path, validator_path)
+        except (OSError, http.client.HTTPException) as ex:
+            logger.info(f'Download of {from_url} was interrupted ({type(ex).__name__}: {ex}). Attempt {attempt} of {max_attempts}')
+            if attempt < max_attempts:
+                time.sleep(2 ** attempt)
+            continue
+
+        if sha256 is not None and digest != sha256:
+            _remove(part_path, validator_path)
+            logger.info(f'> Downloaded file from {from_url} has sha256 {digest}, but {sha256} was expected')
+            if resumed and attempt < max_attempts:
+                continue
+            exit(1)
+
+        os.replace(part_path, download_file_path)
+        _remove(validator_path)
+        write_text(f'{download_file_path}.sha256', digest)
+        write_text(f'{download_file_path}.url', from_url)
+        return
+
+    logger.info(f'> Could not download {from_url}. The part already downloaded was kept in {part_path} to be resumed')
+    exit(1)
+
+def recorded_sha256(download_file_path):
+    # The hash of every download is saved next to it, so an existing file can be checked without reading it again
+    sha256_path = f'{download_file_path}.sha256'
+    recorded = read_text(sha256_path)
+    if recorded is None:
+        recorded = hash_file(download_file_path).hexdigest()
+        write_text(sha256_path, recorded)
+    return recorded
+
+# Files are downloaded to a '.part' file that is renamed only when complete (and matching
+# 'sha256', when given), so an interrupted download is never mistaken for a finished one.
+# The URL is kept next to the file too, in '<file>.url', so bundles know where every file came from
+def download(from_url, to_file_name=None, sha256=None):
+    if to_file_name is None:
+        to_file_name = os.path.basename(from_url)
+
+    download_file_path = os.path.join(downloads_path, to_file_name)
+    if os.path.exists(download_file_path):
+        if sha256 is None or recorded_sha256(download_file_path) == sha256:
+            return download_file_path, False
+        logger.info(f"'{download_file_path}' doesn't have the expected sha256. Downloading it again")
+        _remove(download_file_path, f'{download_file_path}.sha256')
+
+    logger.info(f'Downloading {from_url} to {download_file_path}')
+    with transfer_slots, profiler.span(from_url, 'download') as span:
+        _fetch(from_url, download_file_path, sha256)
+        span.status = 'done'
+    return download_file_path, True
+
+def _fetch_if_changed(from_url, download_file_path, headers):
+    parts, connection, response, url = open_url(from_url, headers)
+    if response.status == 304:
+        response.read()
+        release_connection(parts, connection, response)
+        return False
+    if response.status != 200:
+        response.read()
+        release_connection(parts, connection, response)
+        logger.info(f'> An error happened while downloading: {from_url}')
+        logger.info(f'Status: {response.status} {response.reason} ({url})')
+        exit(1)
+
+    digest = hashlib.sha256()
+    part_path = f'{download_file_path}.part'
+    try:
+        with open(part_path, 'wb') as f:
+            while chunk := response.read(chunk_size):
+                f.write(chunk)
+                digest.update(chunk)
+                profiler.add_downloaded_bytes(len(chunk))
+    except BaseException:
+        connection.close()
+        raise
+    release_connection(parts, connection, response)
+
+    changed = read_text(f'{download_file_path}.sha256') != digest.hexdigest()
+    os.replace(part_path, download_file_path)
+    write_text(f'{download_file_path}.sha256', digest.hexdigest())
+    write_text(f'{download_file_path}.url', from_url)
+    save_validators(from_url, response)
+    return changed
+
+# For URLs whose content moves, like '.../latest' or install scripts: the file is downloaded again only
+# when the server doesn't answer the conditional request with '304 Not Modified'. Returns (path, changed),
+# where changed is False when the content is the same as before
+def download_if_changed(from_url, to_file_name=None):
+    if to_file_name is None:
+        to_file_name = os.path.basename(from_url)
+
+    download_file_path = os.path.join(downloads_path, to_file_name)
+    headers = _conditional_headers(from_url) if os.path.exists(download_file_path) else {}
+    with transfer_slots, profiler.span(from_url, 'download') as span:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                changed = _fetch_if_changed(from_url, download_file_path, headers)
+                break
+            except (OSError, http.client.HTTPException) as ex:
+                logger.info(f'Download of {from_url} was interrupted ({type(ex).__name__}: {ex}). Attempt {attempt} of {max_attempts}')
+                if attempt < max_attempts:
+                    time.sleep(2 ** attempt)
+        else:
+            logger.info(f'> Could not download {from_url}')
+            exit(1)
+        span.status = 'done' if changed else 'not modified'
+    if not changed:
+        logger.info(f"'{download_file_path}' is up to date with {from_url}")
+    return download_file_path, changed
+
+def download_all(downloads):
+    # Downloads every (from_url, to_file_name, sha256) item at the same time and returns
+    # the (path, downloaded) results in the same order. Items can also be just the url
+    downloads = [item if isinstance(item, tuple) else (item,) for item in downloads]
+    step_span = profiler.current()
+    def download_for_step(item):
+        with profiler.within(step_span):
+            return download(*item)
+    with ThreadPoolExecutor(max_workers=max(1, len(downloads))) as executor:
+        futures = [executor.submit(download_for_step, item) for item in downloads]
+    return [future.result() for future in futures]
@@ -0,0 +1,85 @@
+import functools
+import os
+import platform
+import pwd
+import shutil
+import threading
+
+from .paths import home_path
+from .shell import bash
+from .transports import target
+
+# What the steps need to know about the machine, found once per run and without starting processes when possible,
+# instead of commands like '$(lsb_release -cs)', '$(which zsh)' or 'zsh -ic "echo $ZSH_CUSTOM"' in every step
+
+# platform.machine() names for the architectures of dpkg
+_dpkg_architectures = {
+    'x86_64': 'amd64',
+    'aarch64': 'arm64',
+    'armv7l': 'armhf',
+    'i686': 'i386',
+    'ppc64le': 'ppc64el',
+    's390x': 's390x',
+}
+
+_tool_paths = {}
+_tool_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def os_release():
+    # Folders used to try steps usually don't have their own, and then the one of this machine is used
+    path = target.path('/etc/os-release')
+    if not os.path.exists(path):
+        path = '/etc/os-release'
+    fields = {}
+    with open(path, 'r') as f:
+        for line in f:
+            key, _, value = line.strip().partition('=')
+            if key:
+                fields[key] = value.strip('"')
+    return fields
+
+@functools.lru_cache(maxsize=None)
+def distribution_codename():
+    # The same as '$(lsb_release -cs)'
+    fields = os_release()
+    return fields.get('UBUNTU_CODENAME') or fields['VERSION_CODENAME']
+
+@functools.lru_cache(maxsize=None)
+def architecture():
+    # The same as '$(dpkg --print-architecture)', which is only asked for machines not in the table
+    machine = platform.machine()
+    if machine in _dpkg_architectures:
+        return _dpkg_architectures[machine]
+    return bash('dpkg --print-architecture', capture=True).stdout.strip()
+
+@functools.lru_cache(maxsize=None)
+def user_name():
+    return os.environ.get('USER') or pwd.getpwuid(os.getuid()).pw_name
+
+def login_shell():
+    # Not cached, since steps change it
+    return pwd.getpwnam(user_name()).pw_shell
+
+def _zsh_variable(name):
+    # oh my zsh exports $ZSH and $ZSH_CUSTOM in the shell autopy was started from. They are paths of this machine,
+    # which the fleet runner passes on to the targets too, so in 'root:' targets they are not the target's
+    path = os.environ.get(name)
+    return path if path and target.path(path) == path else None
+
+def oh_my_zsh_path():
+    return _zsh_variable('ZSH') or os.path.join(home_path, '.oh-my-zsh')
+
+def zsh_custom_path():
+    # What oh my zsh sets $ZSH_CUSTOM to when the .zshrc doesn't set it
+    return _zsh_variable('ZSH_CUSTOM') or os.path.join(oh_my_zsh_path(), 'custom')
+
+def tool_path(name):
+    # The same as '$(which name)'. Only found tools are kept, since the steps may install the missing ones later
+    with _tool_lock:
+        if name not in _tool_paths:
+            path = shutil.which(name)
+            if path is None:
+                return None
+            _tool_paths[name] = path
+        return _tool_paths[name]
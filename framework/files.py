@@ -0,0 +1,177 @@
+import hashlib
+import os
+import re
+import shlex
+import stat
+import tempfile
+
+from .log import logger
+from .shell import bash
+from .transports import target
+
+def create_folder(folder_path):
+    folder_path = target.path(folder_path)
+    if not os.path.exists(folder_path):
+        os.mkdir(folder_path)
+        logger.info(f"Created '{folder_path}' directory")
+
+def all_exist(*paths):
+    return all(os.path.exists(target.path(path)) for path in paths)
+
+# The sha256 of the content of a file, read in chunks. Returns the hashlib object, for .digest() or .hexdigest()
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest
+
+def _render(source_path, template_vars):
+    with open(source_path, 'r') as f:
+        content = f.read()
+    for name, value in template_vars.items():
+        content = content.replace(f'{{{{{name}}}}}', str(value))
+    return content.encode()
+
+def _same_content(source_path, content, destination_stat, destination_path):
+    if content is not None:
+        if destination_stat.st_size != len(content):
+            return False
+        with open(destination_path, 'rb') as f:
+            return f.read() == content
+    source_stat = os.stat(source_path)
+    if destination_stat.st_size != source_stat.st_size:
+        return False
+    # Copies keep the modification time of the source, so an unchanged file is found without reading it
+    if destination_stat.st_mtime_ns == source_stat.st_mtime_ns:
+        return True
+    return hash_file(destination_path).digest() == hash_file(source_path).digest()
+
+def _write(source_path, content, destination_path, mode):
+    destination_folder = os.path.dirname(destination_path) or '.'
+    if os.access(destination_folder, os.W_OK):
+        # Written next to the destination and renamed over it, so it is never seen half written
+        fd, temporary_path = tempfile.mkstemp(dir=destination_folder, prefix=f'.{os.path.basename(destination_path)}.')
+        try:
+            with os.fdopen(fd, 'wb') as target:
+                if content is not None:
+                    target.write(content)
+                else:
+                    with open(source_path, 'rb') as source:
+                        while chunk := source.read(1024 * 1024):
+                            target.write(chunk)
+            os.chmod(temporary_path, mode)
+            if content is None:
+                source_stat = os.stat(source_path)
+                os.utime(temporary_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+            os.replace(temporary_path, destination_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return
+
+    rendered_path = None
+    if content is not None:
+        fd, rendered_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+    temporary_path = os.path.join(destination_folder, f'.{os.path.basename(destination_path)}.autopy')
+    try:
+        bash(
+            f'sudo cp --preserve=timestamps {shlex.quote(rendered_path or source_path)} {shlex.quote(temporary_path)}'
+            f' && sudo chmod {mode:o} {shlex.quote(temporary_path)}'
+            f' && sudo mv -f {shlex.quote(temporary_path)} {shlex.quote(destination_path)}'
+        )
+    finally:
+        if rendered_path is not None:
+            os.remove(rendered_path)
+
+def _chmod(destination_path, mode):
+    if os.access(destination_path, os.W_OK) and os.stat(destination_path).st_uid == os.getuid():
+        os.chmod(destination_path, mode)
+    else:
+        bash(f'sudo chmod {mode:o} {shlex.quote(destination_path)}')
+
+# True when destination_path has the content install_file would write and the given mode. Doesn't change anything
+def file_is_current(source_path, destination_path, mode=None, template_vars=None):
+    content = _render(source_path, template_vars) if template_vars is not None else None
+    try:
+        destination_stat = os.stat(target.path(destination_path))
+    except FileNotFoundError:
+        return False
+    if mode is not None and stat.S_IMODE(destination_stat.st_mode) != mode:
+        return False
+    return _same_content(source_path, content, destination_stat, target.path(destination_path))
+
+def _deploy(source_path, content, destination_path, mode):
+    destination_path = target.path(destination_path)
+    try:
+        destination_stat = os.stat(destination_path)
+    except FileNotFoundError:
+        destination_stat = None
+
+    if destination_stat is not None and _same_content(source_path, content, destination_stat, destination_path):
+        if stat.S_IMODE(destination_stat.st_mode) == mode:
+            logger.info(f"'{destination_path}' is up to date")
+            return False
+        _chmod(destination_path, mode)
+        logger.info(f"Changed mode of '{destination_path}' to {mode:o}")
+        return True
+
+    _write(source_path, content, destination_path, mode)
+    logger.info(f"Installed '{source_path or 'generated content'}' to '{destination_path}'")
+    return True
+
+# Copies source_path to destination_path only when the content or the mode is different, replacing
+# '{{NAME}}' placeholders of the source by 'template_vars' when given. The mode defaults to the one of the
+# source. Folders that are not writable, like /usr/local/bin, are written with sudo. Returns True when
+# the destination changed.
+def install_file(source_path, destination_path, mode=None, template_vars=None):
+    if mode is None:
+        mode = stat.S_IMODE(os.stat(source_path).st_mode)
+    content = _render(source_path, template_vars) if template_vars is not None else None
+    return _deploy(source_path, content, destination_path, mode)
+
+# Like install_file, for content generated by the script instead of a file of the repository
+def write_file(destination_path, content, mode=0o644):
+    if isinstance(content, str):
+        content = content.encode()
+    return _deploy(None, content, destination_path, mode)
+
+def _block_markers(marker, comment):
+    return f'{comment} >>> {marker} (managed by autopy) >>>', f'{comment} <<< {marker} <<<'
+
+def _read_text(path):
+    try:
+        with open(target.path(path), 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
+
+def _with_block(text, marker, content, comment):
+    begin, end = _block_markers(marker, comment)
+    if content and not content.endswith('\n'):
+        content += '\n'
+    block = f'{begin}\n{content}{end}\n'
+    existing = re.compile(rf'^{re.escape(begin)}\n.*?^{re.escape(end)}(\n|$)', re.S | re.M)
+    if existing.search(text):
+        return existing.sub(lambda match: block, text, count=1)
+    separator = '' if not text or text.endswith('\n') else '\n'
+    return f'{text}{separator}{block}'
+
+def has_block(path, marker, comment='#'):
+    begin, _ = _block_markers(marker, comment)
+    return begin in _read_text(path).splitlines()
+
+def block_is_current(path, marker, content, comment='#'):
+    text = _read_text(path)
+    return has_block(path, marker, comment) and _with_block(text, marker, content, comment) == text
+
+# Keeps 'content' between '# >>> marker' and '# <<< marker' lines of the file, replacing the block in place when it
+# is already there and appending it otherwise, so running it again never adds the same lines twice. The rest of the
+# file is left as it is. Written like write_file: atomically and only when it changed. Returns True when it changed.
+def managed_block(path, marker, content, comment='#'):
+    text = _read_text(path)
+    mode = stat.S_IMODE(os.stat(target.path(path)).st_mode) if os.path.exists(target.path(path)) else 0o644
+    return write_file(path, _with_block(text, marker, content, comment), mode)
@@ -0,0 +1,71 @@
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .log import logger
+from .paths import configuration_path, downloads_path, home_path
+from .transports import remote_repository_folder, transport_for
+
+# Where the output of autopy in every target is kept
+fleet_logs_path = os.path.join(configuration_path, 'fleet')
+default_max_parallel = 4
+
+def _log_path(transport):
+    return os.path.join(fleet_logs_path, f"{re.sub(r'[^A-Za-z0-9.@-]+', '_', transport.name).strip('_')}.log")
+
+def _shell(command_text, log_file, environment=None):
+    log_file.write(f'$ {command_text}\n')
+    log_file.flush()
+    return subprocess.run(['bash', '-c', command_text], stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                          env={**os.environ, **(environment or {})}, cwd=os.path.dirname(os.path.abspath(sys.argv[0]))).returncode
+
+def _provision(transport, script_name, arguments):
+    # What is the same for every target (the repository and the downloads this machine already has) is uploaded
+    # before autopy runs there, so the targets don't download it again. Returns (status, seconds, log path)
+    started_at = time.monotonic()
+    log_path = _log_path(transport)
+    if transport.runs_here:
+        # A folder used as a target may not have the home yet, which every machine has
+        os.makedirs(transport.home_path(home_path), exist_ok=True)
+    with open(log_path, 'w') as log_file:
+        uploads = [(downloads_path, os.path.relpath(downloads_path, home_path))]
+        if not transport.runs_here:
+            uploads.insert(0, (os.path.dirname(os.path.abspath(sys.argv[0])), remote_repository_folder))
+        for source_path, relative_path in uploads:
+            upload_command = transport.upload_command(source_path, relative_path, home_path)
+            if upload_command is not None and os.path.isdir(source_path) and _shell(upload_command, log_file) != 0:
+                return 'upload failed', time.monotonic() - started_at, log_path
+
+        return_code = _shell(transport.autopy_command(script_name, arguments), log_file, transport.environment(home_path))
+    return ('done' if return_code == 0 else f'failed (exit {return_code})'), time.monotonic() - started_at, log_path
+
+# Configures every target with the same steps, at most max_parallel of them at the same time. Each target runs
+# autopy in its own process (steps keep state for the run, like what is installed), with the output in
+# ~/configuration/fleet/<target>.log. 'arguments' are the ones autopy gets in every target, like ['--profile', 'wsl2'].
+# Returns the targets that failed.
+def run_fleet(specifications, arguments, max_parallel=default_max_parallel):
+    transports = [transport_for(specification) for specification in dict.fromkeys(specifications)]
+    script_name = os.path.basename(sys.argv[0])
+    os.makedirs(fleet_logs_path, exist_ok=True)
+    logger.info(f'Configuring {len(transports)} targets, {max_parallel} at a time')
+    for transport in transports:
+        if transport.warning is not None:
+            logger.info(f"{transport.name}: {transport.warning}")
+
+    def provision_target(transport):
+        status, seconds, log_path = _provision(transport, script_name, arguments)
+        logger.info(f"{transport.name}: {status} in {seconds:.1f}s (log in '{log_path}')")
+        return status, seconds
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        futures = {transport.name: executor.submit(provision_target, transport) for transport in transports}
+    results = {name: future.result() for name, future in futures.items()}
+
+    failed = [name for name, (status, _) in results.items() if status != 'done']
+    name_width = max((len(name) for name in results), default=0)
+    logger.info(f'Fleet: {len(results) - len(failed)} of {len(results)} targets done')
+    for name, (status, seconds) in results.items():
+        logger.info(f"{'=' if status == 'done' else '!'} {name:<{name_width}}  {status:<20} {seconds:6.1f}s")
+    return failed
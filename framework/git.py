@@ -0,0 +1,68 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from .log import logger
+from .profiler import profiler
+from .shell import bash
+from .transports import target
+
+def git_repo_path(repo_url, clone_path, repo_folder_name=None):
+    if repo_folder_name is None:
+        try:
+            repo_folder_name = re.search(r'^.*/(.*)\.git$', repo_url).group(1)
+        except Exception as ex:
+            logger.info(f"Could not extract repo folder name from url: {repo_url}")
+            exit(1)
+
+    return os.path.join(target.path(clone_path), repo_folder_name)
+
+# depth=1 clones only the last commit, for repos that are only used (like tfenv). filter='blob:none' keeps the
+# whole history but downloads the content of old files only when they are needed, for repos that are worked on.
+# With update=True an existing clone is fast-forwarded to its upstream; if it can't be (local commits or
+# changes in the way) it is left as it is.
+def clone_git_repo(repo_url, clone_path, repo_folder_name=None, depth=None, filter=None, update=False):
+    repo_path = git_repo_path(repo_url, clone_path, repo_folder_name)
+
+    if not os.path.exists(repo_path):
+        options = ''
+        if depth is not None:
+            options += f' --depth={depth}'
+        if filter is not None:
+            options += f' --filter={filter}'
+        bash(f'git clone{options} {repo_url} {repo_path}')
+    elif update:
+        if bash(f'git -C {repo_path} pull --ff-only --quiet', check=False).returncode != 0:
+            logger.info(f"Could not fast-forward '{repo_path}'. Leaving it as it is")
+
+# An existing clone is current when HEAD already has the last commit of its upstream branch. The remote is asked with
+# 'git ls-remote', which doesn't fetch anything, so checks can know if update=True would fast-forward the clone
+def git_repo_is_current(repo_url, clone_path, repo_folder_name=None):
+    repo_path = git_repo_path(repo_url, clone_path, repo_folder_name)
+    if not os.path.exists(repo_path):
+        return False
+    upstream = bash(f'git -C {repo_path} rev-parse --symbolic-full-name @{{u}}', check=False, capture=True)
+    if upstream.returncode != 0:
+        # Without an upstream branch there is nothing to fast-forward to
+        return True
+    remote, _, branch = upstream.stdout.strip().removeprefix('refs/remotes/').partition('/')
+    remote_head = bash(f'git -C {repo_path} ls-remote {remote} refs/heads/{branch}', check=False, capture=True)
+    if remote_head.returncode != 0 or not remote_head.stdout.split():
+        return False
+    return bash(f'git -C {repo_path} merge-base --is-ancestor {remote_head.stdout.split()[0]} HEAD', check=False).returncode == 0
+
+def clone_git_repos(repo_urls, clone_path, depth=None, filter=None, update=False):
+    # Clones (or updates) every repo at the same time. Each git runs in its own bash session
+    step_span = profiler.current()
+    def clone_for_step(repo_url):
+        with profiler.within(step_span):
+            clone_git_repo(repo_url, clone_path, depth=depth, filter=filter, update=update)
+    with ThreadPoolExecutor(max_workers=max(1, len(repo_urls))) as executor:
+        futures = [executor.submit(clone_for_step, repo_url) for repo_url in repo_urls]
+    for future in futures:
+        future.result()
+
+def git_repos_are_current(repo_urls, clone_path):
+    # Asks every remote at the same time, like clone_git_repos
+    with ThreadPoolExecutor(max_workers=max(1, len(repo_urls))) as executor:
+        return all(executor.map(lambda repo_url: git_repo_is_current(repo_url, clone_path), repo_urls))
@@ -0,0 +1,7 @@
+import logging
+
+logging.basicConfig(level=logging.DEBUG, format='%(levelname)s %(asctime)s - %(name)s [%(threadName)s]: %(message)s')
+logger = logging.getLogger('autopy')
+
+def log_section(section_name):
+    logger.info(f'-------------------- {section_name} --------------------')
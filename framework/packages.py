@@ -0,0 +1,195 @@
+import abc
+import contextlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import paths
+from .log import logger
+from .profiler import profiler
+from .shell import bash, shell_session
+
+class PackageManager(abc.ABC):
+    # Package managers other than apt. What is installed is asked once, with a single command, and kept
+    # until the next install. Subclasses say how to ask it, how to install the missing packages and how
+    # to split 'name<separator>version' (the version is optional)
+    name = None
+    version_separator = '@'
+
+    def __init__(self):
+        self._installed = None
+        self._lock = threading.Lock()
+
+    def command(self, command_text):
+        return command_text
+
+    def normalize(self, name):
+        return name
+
+    def split(self, package):
+        name, separator, version = package.rpartition(self.version_separator)
+        # A separator at the start is part of the name, like in npm's '@scope/name'
+        if not separator or not name:
+            return package, ''
+        return name, version
+
+    def installed(self):
+        with self._lock:
+            if self._installed is None:
+                self._installed = {self.normalize(name): version for name, version in self.query().items()}
+            return self._installed
+
+    def is_installed(self, package):
+        name, version = self.split(package)
+        installed_version = self.installed().get(self.normalize(name))
+        if installed_version is None:
+            return False
+        return not version or installed_version == version
+
+    def all_installed(self, packages):
+        return all(self.is_installed(package) for package in packages)
+
+    def install(self, packages):
+        packages = [package for package in dict.fromkeys(packages) if not self.is_installed(package)]
+        if not packages:
+            logger.info(f'All {self.name} packages are already installed')
+            return
+
+        try:
+            self.install_missing(packages)
+        finally:
+            with self._lock:
+                self._installed = None
+
+    # Returns {name: version} of what is installed
+    @abc.abstractmethod
+    def query(self):
+        pass
+
+    @abc.abstractmethod
+    def install_missing(self, packages):
+        pass
+
+class PipPackages(PackageManager):
+    name = 'pip'
+    version_separator = '=='
+
+    def normalize(self, name):
+        return name.lower().replace('_', '-')
+
+    def query(self):
+        output = bash(self.command('pip3 list --format=json'), check=False, capture=True).stdout
+        return {package['name']: package['version'] for package in json.loads(output or '[]')}
+
+    def install_missing(self, packages):
+        bash(self.command(f"sudo pip3 install {' '.join(packages)}"))
+
+class GoPackages(PackageManager):
+    # Packages are like 'sigs.k8s.io/kind@v0.16.0', optionally with build flags before them,
+    # like '-tags=postgres github.com/golang-migrate/migrate/v4/cmd/migrate@v4.15.2'
+    name = 'go'
+
+    def __init__(self, go_path='/usr/local/go/bin', bin_path=None):
+        super().__init__()
+        self.go_path = go_path
+        self._bin_path = bin_path
+
+    @property
+    def bin_path(self):
+        # Where 'go install' puts the binaries by default, asked when used instead of when the module is imported
+        return self._bin_path or os.path.join(paths.home_path, 'go', 'bin')
+
+    @contextlib.contextmanager
+    def session(self):
+        # go is not in the PATH of non interactive shells, so its commands run in a session that exports it once
+        with shell_session():
+            bash(f'export PATH="$PATH:{self.go_path}"')
+            yield
+
+    def split(self, package):
+        # The build flags are part of the name, so a binary built without them doesn't count as installed
+        *flags, path = package.split()
+        name, version = super().split(path)
+        return ' '.join([*flags, name]), version
+
+    def normalize(self, name):
+        # Of the build flags, only the tags can be compared with the ones built into the binaries
+        *flags, path = name.split()
+        tags = sorted({tag for flag in flags if flag.startswith('-tags=') for tag in flag.removeprefix('-tags=').split(',') if tag})
+        return f"-tags={','.join(tags)} {path}" if tags else path
+
+    def query(self):
+        # 'go version -m' reads the module path, version and build settings built into every binary
+        if not os.path.isdir(self.bin_path) or not os.listdir(self.bin_path):
+            return {}
+        binaries = []
+        with self.session():
+            output = bash(f'go version -m {self.bin_path}/*', check=False, capture=True).stdout
+        for line in output.splitlines():
+            fields = line.split()
+            if not line.startswith('\t'):
+                binaries.append({'flags': []})
+            elif not binaries or len(fields) < 2:
+                continue
+            elif fields[0] == 'path':
+                binaries[-1]['path'] = fields[1]
+            elif fields[0] == 'mod' and len(fields) > 2:
+                binaries[-1]['version'] = fields[2]
+            elif fields[0] == 'build' and fields[1].startswith('-tags='):
+                binaries[-1]['flags'].append(fields[1])
+        return {' '.join([*binary['flags'], binary['path']]): binary['version'] for binary in binaries if 'path' in binary and 'version' in binary}
+
+    def install_missing(self, packages):
+        # go can't install packages of different modules in one call, so they are built at the same time.
+        # They share go's build cache, so what they have in common is built only once
+        step_span = profiler.current()
+        def install_for_step(package):
+            with profiler.within(step_span), self.session():
+                bash(f'go install {package}')
+        with ThreadPoolExecutor(max_workers=len(packages)) as executor:
+            futures = [executor.submit(install_for_step, package) for package in packages]
+        for future in futures:
+            future.result()
+
+class FlatpakPackages(PackageManager):
+    # Applications and runtimes, optionally with a branch, like 'org.gnome.Platform//45'
+    name = 'flatpak'
+    version_separator = '//'
+
+    def __init__(self, remote='flathub'):
+        super().__init__()
+        self.remote = remote
+
+    def query(self):
+        packages = {}
+        for line in bash('flatpak list --columns=application,branch', check=False, capture=True).stdout.splitlines():
+            fields = line.split()
+            if fields:
+                packages[fields[0]] = fields[1] if len(fields) > 1 else ''
+        return packages
+
+    def install_missing(self, packages):
+        bash(f"flatpak install -y --noninteractive {self.remote} {' '.join(packages)}")
+
+class NpmPackages(PackageManager):
+    # Global packages of the node installed by nvm
+    name = 'npm'
+
+    # Also used for nvm's own commands, like 'nvm install --lts'
+    def command(self, command_text):
+        # nvm is a shell function, so it is loaded in a subshell to not change the session
+        return f'(. "$HOME/.nvm/nvm.sh" && {command_text})'
+
+    def query(self):
+        output = bash(self.command('npm ls -g --depth=0 --json'), check=False, capture=True).stdout
+        dependencies = json.loads(output or '{}').get('dependencies', {})
+        return {name: package.get('version', '') for name, package in dependencies.items()}
+
+    def install_missing(self, packages):
+        bash(self.command(f"npm install -g {' '.join(packages)}"))
+
+pip_packages = PipPackages()
+go_packages = GoPackages()
+flatpak_packages = FlatpakPackages()
+npm_packages = NpmPackages()
@@ -0,0 +1,14 @@
+import os
+from pathlib import Path
+
+from .transports import target
+
+home_path = target.home_path(str(Path.home()))
+files_path = os.path.join(home_path, 'files')
+configuration_path = os.path.join(home_path, 'configuration')
+downloads_path = os.path.join(configuration_path, 'downloads')
+code_path = os.path.join(files_path, 'code')
+state_path = os.path.join(configuration_path, 'autopy-state.json')
+trace_path = os.path.join(configuration_path, 'autopy-trace.json')
+# ETag / Last-Modified of the URLs whose content moves, like '.../latest', so they are only downloaded again when they change
+http_cache_path = os.path.join(configuration_path, 'http-cache.json')
@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .apt import installed_packages, is_installed
+from .log import logger
+from .paths import state_path
+from .shell import session_pool
+from .state import StepState
+from .steps import registry, skip_reason
+
+def _nothing():
+    pass
+
+def _does_nothing(function):
+    # Like the package steps whose body is just 'pass', which only need their packages
+    code = getattr(function, '__code__', None)
+    return code is not None and code.co_code == _nothing.__code__.co_code
+
+def _probe(current, state):
+    # Only reads: the dpkg status, the step's check and the recorded fingerprint. Returns why the step would run
+    reasons = []
+    missing_packages = [package for package in current.packages if not is_installed(package)]
+    if missing_packages:
+        reasons.append(f"missing packages: {', '.join(missing_packages)}")
+
+    if current.check is None:
+        if not _does_nothing(current.function):
+            reasons.append('has no check, always runs')
+        return reasons
+
+    try:
+        converged = bool(current.check())
+    except (Exception, SystemExit) as ex:
+        converged = False
+        reasons.append(f'check raised {type(ex).__name__}: {ex}')
+    else:
+        if not converged:
+            reasons.append('check fails')
+
+    if converged and not state.is_current(current.name, current.fingerprint()):
+        reasons.append('changed since the last run' if state.has_run(current.name) else 'never ran')
+    return reasons
+
+# Shows what a run would do, without changing anything. Every step is probed at the same time
+def plan_steps(steps=None, max_workers=16):
+    if steps is None:
+        steps = registry
+    started_at = time.monotonic()
+    state = StepState(state_path)
+    # Read once here, instead of by the first probes at the same time
+    installed_packages()
+
+    # Steps this run can't do are not probed, their checks would fail for the same reason
+    skipped = {name: skip_reason(current) for name, current in steps.items() if skip_reason(current) is not None}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_probe, current, state) for name, current in steps.items() if name not in skipped}
+    reasons = {name: future.result() for name, future in futures.items()}
+    session_pool.close()
+
+    changing = [name for name in reasons if reasons[name]]
+    name_width = max((len(name) for name in steps), default=0)
+    logger.info(f'Plan: {len(changing)} of {len(steps)} steps would run, {len(skipped)} would be skipped'
+                f' (probed in {time.monotonic() - started_at:.2f}s)')
+    for name in steps:
+        if name in skipped:
+            logger.info(f'- {name:<{name_width}}  skipped: {skipped[name]}')
+        elif reasons[name]:
+            logger.info(f"+ {name:<{name_width}}  {'; '.join(reasons[name])}")
+        else:
+            logger.info(f'= {name:<{name_width}}  up to date')
+    return changing
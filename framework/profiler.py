@@ -0,0 +1,121 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+from .log import logger
+
+# How many steps are listed in the summary of the slowest ones
+slowest_steps_shown = 10
+
+class Span:
+    def __init__(self, name, category, parent):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.thread_name = threading.current_thread().name
+        self.start = time.monotonic()
+        self.end = None
+        self.status = None
+        self.cpu_seconds = 0.0
+        self.downloaded_bytes = 0
+
+    def duration(self):
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+class Profiler:
+    # Records how long every step, command and download took, with the CPU time of the commands
+    # and the bytes downloaded, added up on the step they ran for
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._current = threading.local()
+
+    def current(self):
+        return getattr(self._current, 'span', None)
+
+    @contextlib.contextmanager
+    def within(self, span):
+        # Makes the spans of another thread, like the ones of download_all, count for the given one
+        previous = self.current()
+        self._current.span = span
+        try:
+            yield span
+        finally:
+            self._current.span = previous
+
+    @contextlib.contextmanager
+    def span(self, name, category):
+        current = Span(name, category, self.current())
+        with self._lock:
+            self.spans.append(current)
+        with self.within(current):
+            try:
+                yield current
+            except SystemExit:
+                current.status = current.status or 'failed'
+                raise
+            except BaseException:
+                current.status = 'error'
+                raise
+            finally:
+                current.end = time.monotonic()
+
+    def add_cpu_seconds(self, cpu_seconds):
+        with self._lock:
+            span = self.current()
+            while span is not None:
+                span.cpu_seconds += cpu_seconds
+                span = span.parent
+
+    def add_downloaded_bytes(self, size):
+        with self._lock:
+            span = self.current()
+            while span is not None:
+                span.downloaded_bytes += size
+                span = span.parent
+
+    def log_summary(self):
+        steps = sorted((span for span in self.spans if span.category == 'step'), key=Span.duration, reverse=True)
+        if not steps:
+            return
+        name_width = max(len(span.name) for span in steps[:slowest_steps_shown])
+        logger.info(f'Slowest steps (total {time.monotonic() - self.started_at:.1f}s):')
+        logger.info(f"{'Step':<{name_width}}  {'Time':>8}  {'CPU':>8}  {'Downloaded':>10}  Status")
+        for span in steps[:slowest_steps_shown]:
+            logger.info(
+                f'{span.name:<{name_width}}  {span.duration():>7.1f}s  {span.cpu_seconds:>7.1f}s  '
+                f'{span.downloaded_bytes / 1024 / 1024:>8.1f}MB  {span.status or "running"}'
+            )
+
+    def write_trace(self, path):
+        # Chrome trace event format, which can be opened in chrome://tracing or https://ui.perfetto.dev
+        thread_ids = {}
+        events = []
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            thread_id = thread_ids.setdefault(span.thread_name, len(thread_ids) + 1)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'pid': 1,
+                'tid': thread_id,
+                'ts': round((span.start - self.started_at) * 1_000_000),
+                'dur': round(span.duration() * 1_000_000),
+                'args': {'status': span.status, 'cpu_seconds': round(span.cpu_seconds, 3), 'downloaded_bytes': span.downloaded_bytes},
+            })
+        for thread_name, thread_id in thread_ids.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread_id, 'args': {'name': thread_name}})
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        os.replace(temporary_path, path)
+        logger.info(f"Trace of this run written to '{path}'")
+
+profiler = Profiler()
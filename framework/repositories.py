@@ -0,0 +1,76 @@
+import base64
+import os
+import threading
+
+from .apt import mark_apt_sources_changed
+from .downloads import download, download_if_changed, has_changed
+from .files import all_exist, write_file
+from .log import logger
+
+keyrings_path = '/usr/share/keyrings'
+sources_path = '/etc/apt/sources.list.d'
+keyserver_url = 'https://keyserver.ubuntu.com'
+
+_armor_begin = '-----BEGIN PGP PUBLIC KEY BLOCK-----'
+_armor_end = '-----END PGP PUBLIC KEY BLOCK-----'
+
+_registered = {}
+_lock = threading.Lock()
+
+def keyring_path(name):
+    return os.path.join(keyrings_path, f'{name}-archive-keyring.gpg')
+
+def source_path(name):
+    return os.path.join(sources_path, f'{name}.list')
+
+# For keys from key_url, the key is asked again with a conditional request, so a changed key registers the repository again
+def is_repository_registered(name, key_url=None):
+    return all_exist(keyring_path(name), source_path(name)) and (key_url is None or not has_changed(key_url))
+
+def _dearmor(key):
+    # The same as 'gpg --dearmor': the base64 between the armor lines, without the headers and the '=' checksum line
+    text = key.decode('ascii', errors='replace')
+    if _armor_begin not in text:
+        return key
+    binary = b''
+    for block in text.split(_armor_begin)[1:]:
+        lines = [line.strip() for line in block.split(_armor_end)[0].strip().splitlines()]
+        if '' in lines:
+            lines = lines[lines.index('') + 1:]
+        binary += base64.b64decode(''.join(line for line in lines if line and not line.startswith('=')))
+    return binary
+
+# Registers an apt repository: its signing key in /usr/share/keyrings/<name>-archive-keyring.gpg and
+# 'deb [signed-by=...] <line>' in /etc/apt/sources.list.d/<name>.list, where line is like
+# 'https://download.docker.com/linux/ubuntu jammy stable'. The key comes from key_url (asked again with a
+# conditional request) or from the keyserver by its fingerprint (downloaded once, since a fingerprint always
+# has the same key). Files are only written when they change, and then the next apt_install runs a single
+# 'apt-get update' for every repository that changed.
+def apt_repository(name, line, key_url=None, keyserver_id=None, architectures=None):
+    if (key_url is None) == (keyserver_id is None):
+        logger.info(f"Repository '{name}' needs either a key_url or a keyserver_id")
+        exit(1)
+    definition = (line, key_url, keyserver_id, tuple(architectures or ()))
+    with _lock:
+        if name in _registered:
+            if _registered[name] != definition:
+                logger.info(f"Repository '{name}' was registered twice with different settings")
+                exit(1)
+            logger.info(f"Repository '{name}' is already registered")
+            return
+        _registered[name] = definition
+
+    keyring = keyring_path(name)
+    if keyserver_id is not None:
+        key_path, _ = download(f'{keyserver_url}/pks/lookup?op=get&options=mr&search=0x{keyserver_id}', f'{name}.key')
+    else:
+        key_path, _ = download_if_changed(key_url, f'{name}.key')
+    with open(key_path, 'rb') as f:
+        changed = write_file(keyring, _dearmor(f.read()))
+
+    options = [f'signed-by={keyring}']
+    if architectures:
+        options.insert(0, f"arch={','.join(architectures)}")
+    changed = write_file(source_path(name), f"deb [{' '.join(options)}] {line}\n") or changed
+    if changed:
+        mark_apt_sources_changed()
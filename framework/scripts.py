@@ -0,0 +1,25 @@
+from urllib.parse import urlsplit
+
+from .downloads import download_if_changed, read_text, recorded_sha256, write_text
+from .log import logger
+from .shell import bash
+
+def _script_file_name(from_url):
+    # Many installers are called install.sh, so the host and the path are part of the name
+    parts = urlsplit(from_url)
+    return f'{parts.netloc}{parts.path}'.strip('/').replace('/', '_')
+
+# Runs an installer that is usually piped from curl, like 'curl -fsSL <url> | bash'. The script is kept in the
+# downloads folder and asked again with a conditional request, and it only runs again when its content is
+# different from the last time it ran successfully. '{script}' in command is replaced by the path of the script.
+def run_script(from_url, command='bash {script}'):
+    script_path, _ = download_if_changed(from_url, _script_file_name(from_url))
+    executed_path = f'{script_path}.executed'
+    sha256 = recorded_sha256(script_path)
+    if read_text(executed_path) == sha256:
+        logger.info(f"'{from_url}' didn't change since it last ran")
+        return False
+
+    bash(command.format(script=script_path))
+    write_text(executed_path, sha256)
+    return True
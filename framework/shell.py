@@ -0,0 +1,234 @@
+import collections
+import contextlib
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+from .log import logger
+from .profiler import profiler
+from .transports import target
+
+# Return code used when a command is killed because it took longer than its timeout, like the timeout(1) command
+TIMEOUT_RETURN_CODE = 124
+
+_end_marker = '__autopy_end__'
+
+# How many lines of the output of a command are kept to be shown when it fails
+output_tail_lines = 50
+
+_clock_ticks = os.sysconf('SC_CLK_TCK')
+
+def _children_cpu_seconds(pid):
+    # CPU time of the children the process already waited for (cutime and cstime in /proc/<pid>/stat)
+    try:
+        with open(f'/proc/{pid}/stat', 'r') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[13]) + int(fields[14])) / _clock_ticks
+
+def _kill_tree(pid):
+    # Kills the process and everything it started, so a command that timed out doesn't leave children behind
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                parent_pid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent_pid, []).append(int(entry))
+
+    to_kill = [pid]
+    for current in to_kill:
+        to_kill.extend(children.get(current, []))
+    for current in reversed(to_kill):
+        try:
+            os.kill(current, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+class CommandOutput:
+    # Logs every line as soon as the command prints it. Only the last lines are kept for the
+    # error report, unless the caller needs the whole output, so noisy commands don't fill the memory
+    def __init__(self, capture):
+        self._lines = {stream: [] if capture else collections.deque(maxlen=output_tail_lines) for stream in ('stdout', 'stderr')}
+
+    def add(self, stream, line):
+        logger.debug(f'[{stream}] {line.rstrip(chr(10))}')
+        self._lines[stream].append(line)
+
+    def remove_last_new_line(self, stream):
+        lines = self._lines[stream]
+        if lines and lines[-1].endswith('\n'):
+            lines[-1] = lines[-1][:-1]
+
+    def text(self, stream):
+        return ''.join(self._lines[stream])
+
+def _read(stream, pipe, lines):
+    for line in pipe:
+        lines.put((stream, line))
+    lines.put((stream, None))
+
+def _start_readers(process, lines):
+    for stream, pipe in (('stdout', process.stdout), ('stderr', process.stderr)):
+        threading.Thread(target=_read, args=(stream, pipe, lines), daemon=True).start()
+
+def _next_line(lines, deadline):
+    remaining = None if deadline is None else max(0, deadline - time.monotonic())
+    try:
+        return lines.get(timeout=remaining)
+    except queue.Empty:
+        return None, None
+
+class ShellSession:
+    # A long lived bash process that runs one command after the other, reading them from its stdin.
+    # Each command runs through 'eval', so a syntax error or a failing command doesn't end the session.
+    # With subshell=True the command runs in '( ... )', a fork of the session that keeps nothing it changes
+    # (variables, options, functions, umask); otherwise that state stays for the next commands of the session.
+    def __init__(self):
+        self.process = subprocess.Popen(
+            ['bash', '--noprofile', '--norc'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, errors='replace', bufsize=1,
+        )
+        self._lines = queue.Queue()
+        _start_readers(self.process, self._lines)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        if self.is_alive():
+            _kill_tree(self.process.pid)
+        self.process.wait()
+
+    # Returns the return code and the CPU time used by the processes the command started
+    def run(self, command_text, output, timeout=None, subshell=False):
+        cpu_seconds_before = _children_cpu_seconds(self.process.pid)
+        token = uuid.uuid4().hex
+        marker = f'{_end_marker}{token}'
+        # The command goes quoted to 'eval' and its stdin is /dev/null, so it can't read the next commands.
+        # A new line is printed before the markers so they always start a line, and is removed from the output
+        self.process.stdin.write(
+            f"{'( ' if subshell else ''}eval {shlex.quote(command_text)}{' )' if subshell else ''} </dev/null\n"
+            f'__autopy_return_code=$?\n'
+            f'builtin cd {shlex.quote(os.getcwd())}\n'
+            f'printf "\\n{marker} %d\\n" $__autopy_return_code\n'
+            f'printf "\\n{marker}\\n" >&2\n'
+        )
+        self.process.stdin.flush()
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Blank lines are held back until the next line arrives, because the last one is the new line added before the marker
+        held_back_blank_line = {'stdout': False, 'stderr': False}
+        finished = set()
+        return_code = None
+        while len(finished) < 2:
+            stream, line = _next_line(self._lines, deadline)
+            if stream is None or line is None:
+                # Either the command ended the session (like 'exit 3') or it timed out
+                self.close()
+                return (TIMEOUT_RETURN_CODE if stream is None else self.process.returncode), 0.0
+            if line.startswith(marker):
+                if not held_back_blank_line[stream]:
+                    # The output didn't end with a new line, so the one added went to its last line
+                    output.remove_last_new_line(stream)
+                finished.add(stream)
+                if stream == 'stdout':
+                    return_code = int(line.split()[1])
+                continue
+            if held_back_blank_line[stream]:
+                output.add(stream, '\n')
+            held_back_blank_line[stream] = line == '\n'
+            if not held_back_blank_line[stream]:
+                output.add(stream, line)
+        cpu_seconds_after = _children_cpu_seconds(self.process.pid)
+        if cpu_seconds_before is None or cpu_seconds_after is None:
+            return return_code, 0.0
+        return return_code, cpu_seconds_after - cpu_seconds_before
+
+class ShellSessionPool:
+    def __init__(self):
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            while self._idle:
+                session = self._idle.pop()
+                if session.is_alive():
+                    return session
+        return ShellSession()
+
+    def release(self, session):
+        if not session.is_alive():
+            return
+        with self._lock:
+            self._idle.append(session)
+
+    def close(self):
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            session.close()
+
+session_pool = ShellSessionPool()
+_pinned = threading.local()
+
+@contextlib.contextmanager
+def shell_session():
+    # Every bash() call of this thread inside the 'with' block runs in the same session, so something like
+    # 'export PATH=...' or a function loaded by one command is seen by the next ones. The session is closed
+    # at the end instead of going back to the pool, so that state never reaches other commands
+    if getattr(_pinned, 'session', None) is not None:
+        yield _pinned.session
+        return
+    session = ShellSession()
+    _pinned.session = session
+    try:
+        yield session
+    finally:
+        _pinned.session = None
+        session.close()
+
+def _run_in_session(command_text, output, timeout):
+    pinned_session = getattr(_pinned, 'session', None)
+    if pinned_session is not None:
+        return pinned_session.run(command_text, output, timeout)
+    # Commands outside shell_session() run in a subshell of a pooled session, so each one starts from the
+    # same state, as with a new 'bash -c', whatever ran in that session before
+    session = session_pool.acquire()
+    try:
+        return session.run(command_text, output, timeout, subshell=True)
+    finally:
+        session_pool.release(session)
+
+# Commands run in a reused bash session instead of a new 'bash -c' process every time. The output is
+# logged while the command runs. The returned stdout and stderr have only the last lines of it, unless
+# capture=True is used to get all of it.
+def bash(command_text, check=True, timeout=None, capture=False):
+    logger.info(f'$ {command_text}')
+    output = CommandOutput(capture)
+    with profiler.span(command_text, 'command') as span:
+        return_code, cpu_seconds = _run_in_session(target.command(command_text), output, timeout)
+        profiler.add_cpu_seconds(cpu_seconds)
+        span.status = f'exit {return_code}'
+    completed_process = subprocess.CompletedProcess(['bash', '-c', command_text], return_code, output.text('stdout'), output.text('stderr'))
+    if check and completed_process.returncode != 0:
+        logger.info(f'> An error happened while executing command on bash: {command_text}')
+        if completed_process.returncode == TIMEOUT_RETURN_CODE:
+            logger.info(f'Timed out after {timeout} seconds')
+        logger.info(f'Return Code: {completed_process.returncode}')
+        logger.info(f'Stdout (last {output_tail_lines} lines): \'{completed_process.stdout}\'')
+        logger.info(f'Stderr (last {output_tail_lines} lines): \'{completed_process.stderr}\'')
+        exit(1)
+
+    return completed_process
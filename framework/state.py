@@ -0,0 +1,46 @@
+import json
+import os
+import threading
+import time
+
+from .log import logger
+
+class StepState:
+    # Remembers the fingerprint of every step that finished, so a rerun can skip
+    # the steps whose inputs didn't change. Saved after every step, so an interrupted run keeps its progress
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._steps = {}
+        try:
+            with open(path, 'r') as f:
+                self._steps = json.load(f).get('steps', {})
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError):
+            logger.info(f"Ignoring state file '{path}' because it could not be read")
+
+    def is_current(self, name, fingerprint):
+        with self._lock:
+            return self._steps.get(name, {}).get('fingerprint') == fingerprint
+
+    def record(self, name, fingerprint):
+        with self._lock:
+            self._steps[name] = {'fingerprint': fingerprint, 'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            self._save()
+
+    def has_run(self, name):
+        with self._lock:
+            return name in self._steps
+
+    def forget(self, name):
+        with self._lock:
+            if self._steps.pop(name, None) is not None:
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'steps': self._steps}, f, indent=2, sort_keys=True)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,321 @@
+import copy
+import hashlib
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .apt import apt_install, apt_prefetch, lists_are_current, sources_version
+from .log import logger, log_section
+from .paths import state_path, trace_path
+from .profiler import profiler
+from .shell import bash, session_pool
+from .state import StepState
+from .transports import target
+
+# Resource used by every step that runs apt-get, apt or dpkg (even 'apt-get install --download-only'). Only one
+# of those can hold the dpkg lock at a time, so the scheduler never runs two of them together.
+APT = 'apt'
+
+# What a step can declare in 'needs': running commands with sudo, and the network for tools that download on
+# their own (git, pip, go, npm, flatpak, nvm, installers...) instead of with download()
+SUDO = 'sudo'
+NETWORK = 'network'
+
+# Name of the step that installs, in one transaction, the apt packages declared by every step
+APT_PACKAGES = 'Apt packages'
+# Name of the work that downloads them before, while that step still waits for some repositories
+APT_PREFETCH = 'Apt prefetch'
+
+class Step:
+    def __init__(self, name, function, after=(), uses=(), packages=(), inputs=(), files=(), check=None, tags=(), needs=()):
+        self.name = name
+        self.function = function
+        self.after = list(after)
+        self.uses = sorted(set(uses))
+        self.packages = list(packages)
+        self.inputs = list(inputs)
+        self.files = list(files)
+        self.check = check
+        self.tags = list(tags)
+        # Installing apt packages always needs sudo
+        self.needs = sorted(set(needs) | ({SUDO} if self.packages or APT in self.uses else set()))
+
+    def fingerprint(self):
+        # Changes when the step's code, its declared inputs (URLs, versions...) or the content of its files change
+        digest = hashlib.sha256()
+        try:
+            code = inspect.getsource(self.function)
+        except (OSError, TypeError):
+            code = self.function.__code__.co_code.hex()
+        for item in [self.name, code, *self.packages, *map(str, self.inputs)]:
+            digest.update(item.encode())
+            digest.update(b'\0')
+        for path in self.files:
+            try:
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            except FileNotFoundError:
+                digest.update(b'missing')
+        return digest.hexdigest()
+
+    def is_up_to_date(self, state, fingerprint):
+        # Only steps with a postcondition check are skipped, and only when the check still passes
+        if self.check is None or not state.is_current(self.name, fingerprint):
+            return False
+        # A check that runs a failing bash() exits, which only means the step has to run
+        try:
+            return bool(self.check())
+        except (Exception, SystemExit):
+            return False
+
+registry = {}
+# What this run can't do (a 'needs' value) and why. The steps that need it are skipped with that reason instead
+# of failing halfway, and the steps after them still run
+unavailable = {}
+if not target.can_sudo:
+    unavailable[SUDO] = f"commands of '{target.name}' run on this machine, so they can't use sudo"
+# Profile name -> the tags of the steps it runs
+profiles = {}
+# Tags of the profile being run. Every tag is active when no profile is given
+active_tags = set()
+
+# A step that declares 'packages' runs only after they are installed. Its 'after' steps
+# (usually the ones registering the apt repository) run before the batched install.
+# A step with a 'check' is skipped on reruns while its fingerprint is the same as in the last
+# successful run and check() still returns True. A step with 'tags' only runs in the profiles that have all of them.
+# A step with 'needs' (SUDO, NETWORK) is skipped in the runs that don't have them.
+def step(name, after=(), uses=(), packages=(), inputs=(), files=(), check=None, tags=(), needs=()):
+    def register(function):
+        if name in registry:
+            logger.info(f"Step '{name}' was declared twice")
+            exit(1)
+        registry[name] = Step(name, function, after, uses, packages, inputs, files, check, tags, needs)
+        return function
+    return register
+
+def all_steps():
+    return list(registry)
+
+def profile(name, tags):
+    profiles[name] = set(tags)
+
+def has_tag(tag):
+    # For the steps that do a bit more in some profiles, like the zsh files only used on WSL
+    return tag in active_tags
+
+def _matches(item, current):
+    # 'helm' selects 'Install Helm', and a tag selects every step with it
+    item = item.strip().lower()
+    name = current.name.lower()
+    return item in (name, name.removeprefix('install ')) or item in current.tags
+
+# The names of the steps matched by the items of --only and --force: step names, short names or tags
+def resolve_steps(items, steps):
+    names = []
+    for item in items:
+        matching = [name for name, current in steps.items() if _matches(item, current)]
+        if not matching:
+            logger.info(f"No step matches '{item}'. Steps: {', '.join(steps)}")
+            exit(1)
+        names.extend(matching)
+    return list(dict.fromkeys(names))
+
+# The steps of the profile (the ones without tags, or with all their tags in the profile). With 'only', just the
+# requested steps and the steps they depend on. Dependencies outside the profile only ordered the steps on other
+# machines, so they are dropped.
+def select_steps(profile_name=None, only=()):
+    if profile_name is None:
+        tags = {tag for current in registry.values() for tag in current.tags}
+    elif profile_name in profiles:
+        tags = profiles[profile_name]
+    else:
+        logger.info(f"Unknown profile '{profile_name}'. Profiles: {', '.join(profiles)}")
+        exit(1)
+    active_tags.clear()
+    active_tags.update(tags)
+
+    selected = {}
+    for name, current in registry.items():
+        if not set(current.tags) <= tags:
+            continue
+        current = copy.copy(current)
+        current.after = [dependency for dependency in current.after
+                         if dependency not in registry or set(registry[dependency].tags) <= tags]
+        selected[name] = current
+    if not only:
+        return selected
+
+    wanted = resolve_steps(only, selected)
+    closure = set()
+    while wanted:
+        name = wanted.pop()
+        if name not in closure:
+            closure.add(name)
+            wanted.extend(dependency for dependency in selected[name].after if dependency in selected)
+    return {name: current for name, current in selected.items() if name in closure}
+
+def skip_reason(current):
+    # Why the step can't run in this run, or None when it can
+    reasons = [unavailable[need] for need in current.needs if need in unavailable]
+    return '; '.join(reasons) or None
+
+def _check_graph(steps):
+    for current in steps.values():
+        for dependency in current.after:
+            if dependency not in steps:
+                logger.info(f"Step '{current.name}' depends on unknown step '{dependency}'")
+                exit(1)
+
+    visiting, visited = set(), set()
+    def visit(name, path):
+        if name in visited:
+            return
+        if name in visiting:
+            logger.info(f"Steps have a dependency cycle: {' -> '.join(path + [name])}")
+            exit(1)
+        visiting.add(name)
+        for dependency in steps[name].after:
+            visit(dependency, path + [name])
+        visiting.remove(name)
+        visited.add(name)
+    for name in steps:
+        visit(name, [])
+
+def _prerequisites(steps, current):
+    # What a package step waits for besides other package steps, like its repository being registered
+    for dependency in current.after:
+        if steps[dependency].packages:
+            yield from _prerequisites(steps, steps[dependency])
+        else:
+            yield dependency
+
+def _with_apt_packages_step(steps):
+    package_steps = [current for current in steps.values() if current.packages]
+    if not package_steps:
+        return steps
+
+    # The transaction waits for everything the package steps wait for, like repositories being registered
+    after = list(dict.fromkeys(dependency for current in package_steps for dependency in _prerequisites(steps, current)))
+    packages = [package for current in package_steps for package in current.packages]
+
+    def install_apt_packages():
+        for current in package_steps:
+            logger.info(f"{current.name}: {' '.join(current.packages)}")
+        apt_install(packages, prefetched=True)
+
+    steps_with_transaction = {APT_PACKAGES: Step(APT_PACKAGES, install_apt_packages, after, [APT])}
+    for name, current in steps.items():
+        if current.packages:
+            current = copy.copy(current)
+            current.after = current.after + [APT_PACKAGES]
+        steps_with_transaction[name] = current
+    return steps_with_transaction
+
+def _run_step(current, state, use_cache):
+    threading.current_thread().name = current.name
+    log_section(current.name)
+    with profiler.span(current.name, 'step') as span:
+        reason = skip_reason(current)
+        if reason is not None:
+            logger.info(f'Skipping: {reason}')
+            span.status = 'skipped'
+            return
+
+        fingerprint = current.fingerprint()
+        if use_cache and current.is_up_to_date(state, fingerprint):
+            logger.info('Up to date, skipping')
+            span.status = 'skipped'
+            return
+
+        state.forget(current.name)
+        current.function()
+        state.record(current.name, fingerprint)
+        span.status = 'done'
+
+def _prefetch(package_steps):
+    threading.current_thread().name = APT_PREFETCH
+    with profiler.span(APT_PREFETCH, 'prefetch') as span:
+        logger.info(f"Downloading the packages of {', '.join(current.name for current in package_steps)}")
+        apt_prefetch([package for current in package_steps for package in current.packages])
+        span.status = 'done'
+
+def _ask_sudo_password():
+    # Steps start sudo from several threads at the same time, and their password prompts would mix on the
+    # terminal. Asking it here, before they start, lets every one of them use sudo's cached credentials
+    if target.can_sudo:
+        bash('sudo -v', check=False)
+
+def run_steps(steps=None, max_workers=8, force=(), use_cache=True):
+    if steps is None:
+        steps = registry
+    force = set(resolve_steps(force, steps))
+    _check_graph(steps)
+    state = StepState(state_path)
+    # While the batched install waits for the last repositories, the packages the package lists already have are
+    # downloaded when apt is free, next to the other steps, so the install only has to unpack them. The packages of
+    # repositories registered during the run are not in the lists until the install updates them, so they are left to it
+    prefetch_waits_for = {name: set(_prerequisites(steps, current)) for name, current in steps.items() if current.packages}
+    prefetch_step = Step(APT_PREFETCH, _prefetch, uses=[APT])
+    # The sources_version() when each step was done
+    sources_version_when_done = {}
+    steps = _with_apt_packages_step(steps)
+    _check_graph(steps)
+    if APT_PACKAGES in steps and skip_reason(steps[APT_PACKAGES]) is not None:
+        prefetch_waits_for.clear()
+
+    _ask_sudo_password()
+    pending = dict(steps)
+    done = set()
+    failed = []
+    busy_resources = set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if not failed:
+                # Declaration order is kept among ready steps, so the log still reads top to bottom
+                for name, current in list(pending.items()):
+                    if len(running) >= max_workers:
+                        break
+                    if not all(dependency in done for dependency in current.after):
+                        continue
+                    if busy_resources.intersection(current.uses):
+                        continue
+                    busy_resources.update(current.uses)
+                    running[executor.submit(_run_step, current, state, use_cache and name not in force)] = current
+                    del pending[name]
+
+                ready_to_prefetch = [name for name, waits_for in prefetch_waits_for.items() if waits_for <= done
+                                     and all(lists_are_current(sources_version_when_done[dependency]) for dependency in waits_for)]
+                if (ready_to_prefetch and APT_PACKAGES in pending and APT not in busy_resources
+                        and len(running) < max_workers):
+                    busy_resources.add(APT)
+                    running[executor.submit(_prefetch, [steps[name] for name in ready_to_prefetch])] = prefetch_step
+                    for name in ready_to_prefetch:
+                        del prefetch_waits_for[name]
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                current = running.pop(future)
+                busy_resources.difference_update(current.uses)
+                exception = future.exception()
+                if exception is None:
+                    if current is not prefetch_step:
+                        done.add(current.name)
+                        sources_version_when_done[current.name] = sources_version()
+                    continue
+                failed.append(current.name)
+                if not isinstance(exception, SystemExit):
+                    logger.exception(f"Step '{current.name}' raised an unexpected error", exc_info=exception)
+
+    session_pool.close()
+    profiler.log_summary()
+    profiler.write_trace(trace_path)
+    if failed:
+        logger.info(f"Failed steps: {', '.join(failed)}")
+        if pending:
+            logger.info(f"Steps not executed: {', '.join(pending)}")
+        exit(1)
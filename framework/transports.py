@@ -0,0 +1,154 @@
+import os
+import re
+import shlex
+import sys
+
+from .log import logger
+
+# How a machine being configured (a target) is reached. The autopy process drives 'local' and 'root' targets
+# from here: bash() runs its commands through the target and the file primitives read and write its paths.
+# For 'chroot' and 'ssh' targets the repository is uploaded and autopy runs there, as a local target.
+# AUTOPY_TARGET says which target this process configures, like 'root:/srv/vm-1'. The fleet runner sets it.
+target_variable = 'AUTOPY_TARGET'
+
+# Where the repository and the shared downloads go in chroot and ssh targets, relative to the target's home
+remote_repository_folder = 'autopy'
+
+class LocalTransport:
+    # This machine
+    name = 'local'
+    runs_here = True
+    # Shown when the target is used, for what it can't do
+    warning = None
+    can_sudo = True
+
+    def command(self, command_text):
+        return command_text
+
+    def path(self, path):
+        return path
+
+    def home_path(self, home_path):
+        return home_path
+
+    def autopy_command(self, script_name, arguments):
+        return shlex.join([sys.executable, script_name, *arguments])
+
+    def environment(self, home_path):
+        return {}
+
+    def upload_command(self, source_path, relative_path, home_path):
+        # The shared files are already here
+        return None
+
+# A command that runs something with sudo, like 'sudo apt-get install' or 'cd x && sudo ln -s ...'
+_sudo_pattern = re.compile(r'(^|[\s;&|(`])sudo\s')
+
+class RootTransport(LocalTransport):
+    # Another root folder of this machine, like a mounted image of a VM or a folder to try the fleet runner.
+    # Absolute paths of the file primitives are moved under it (home too), but commands still run on this
+    # machine. The ones with sudo (apt-get, chsh, ln in /usr/local/bin...) would change this machine instead
+    # of the folder, so they are refused, and the steps that need sudo are skipped in these targets.
+    sudo = ''
+    warning = 'commands still run on this machine, so the steps that need sudo are skipped'
+    can_sudo = False
+
+    def __init__(self, root_path):
+        self.root_path = os.path.abspath(root_path)
+        self.name = f'root:{self.root_path}'
+
+    def command(self, command_text):
+        if not self.can_sudo and _sudo_pattern.search(command_text):
+            logger.info(f"> '{self.name}' targets can't run commands with sudo, which would change this machine: {command_text}")
+            exit(1)
+        return command_text
+
+    def path(self, path):
+        if not os.path.isabs(path) or path == self.root_path or path.startswith(f'{self.root_path}/'):
+            return path
+        return f'{self.root_path}{path}'
+
+    def home_path(self, home_path):
+        return self.path(home_path)
+
+    def environment(self, home_path):
+        return {target_variable: self.name, 'HOME': self.home_path(home_path)}
+
+    def upload_command(self, source_path, relative_path, home_path):
+        destination_path = os.path.join(self.home_path(home_path), relative_path)
+        # -u copies only the files that are newer than the ones already there
+        return (f'{self.sudo}mkdir -p {shlex.quote(destination_path)}'
+                f' && {self.sudo}cp -a -u {shlex.quote(source_path)}/. {shlex.quote(destination_path)}/')
+
+class ChrootTransport(RootTransport):
+    # A root folder with its own system, like a debootstrap one. Commands run inside it as root, with 'sudo chroot'
+    sudo = 'sudo '
+    runs_here = False
+    warning = None
+    can_sudo = True
+
+    def __init__(self, root_path):
+        super().__init__(root_path)
+        self.name = f'chroot:{self.root_path}'
+
+    def command(self, command_text):
+        return f'sudo chroot {shlex.quote(self.root_path)} /usr/bin/env HOME=/root /bin/bash -c {shlex.quote(command_text)}'
+
+    def home_path(self, home_path):
+        return self.path('/root')
+
+    def autopy_command(self, script_name, arguments):
+        return self.command(f'cd ~/{remote_repository_folder} && {shlex.join(["python3", script_name, *arguments])}')
+
+    def environment(self, home_path):
+        return {}
+
+class SshTransport(LocalTransport):
+    # Another machine, like '[user@]host[:port]'. Its files are not seen from here, so autopy always runs there
+    runs_here = False
+    ssh_options = ['-o', 'BatchMode=yes', '-o', 'ConnectTimeout=10']
+
+    def __init__(self, address):
+        self.name = f'ssh:{address}'
+        self.host, _, port = address.partition(':')
+        self.options = self.ssh_options + (['-p', port] if port else [])
+
+    def command(self, command_text):
+        # ssh gives the command to the login shell of the target, so it is quoted once more for it
+        return shlex.join(['ssh', *self.options, self.host, f'bash -c {shlex.quote(command_text)}'])
+
+    def path(self, path):
+        logger.info(f"> The files of '{self.name}' can't be reached from here")
+        exit(1)
+
+    def autopy_command(self, script_name, arguments):
+        return self.command(f'cd ~/{remote_repository_folder} && {shlex.join(["python3", script_name, *arguments])}')
+
+    def environment(self, home_path):
+        return {}
+
+    def upload_command(self, source_path, relative_path, home_path):
+        # rsync only sends what the target doesn't have yet, so uploading again costs almost nothing
+        return (f'{self.command(f"mkdir -p ~/{relative_path}")} && rsync -a --exclude=.git -e {shlex.quote(shlex.join(["ssh", *self.options]))}'
+                f' {shlex.quote(source_path)}/ {shlex.quote(f"{self.host}:{relative_path}")}/')
+
+def transport_for(specification):
+    # 'local', 'root:<folder>', 'chroot:<folder>' or 'ssh:[user@]host[:port]'
+    kind, _, address = specification.partition(':')
+    if kind == 'local' and not address:
+        return LocalTransport()
+    if kind == 'root' and address:
+        return RootTransport(address)
+    if kind == 'chroot' and address:
+        return ChrootTransport(address)
+    if kind == 'ssh' and address:
+        return SshTransport(address)
+    logger.info(f"> Unknown target '{specification}'. Use 'local', 'root:<folder>', 'chroot:<folder>' or 'ssh:[user@]host[:port]'")
+    exit(1)
+
+target = transport_for(os.environ.get(target_variable, 'local'))
+if not target.runs_here:
+    logger.info(f"> '{target.name}' targets are configured by the fleet runner, which runs autopy inside them")
+    exit(1)
+if target.warning is not None:
+    logger.info(f"Configuring '{target.name}': {target.warning}")
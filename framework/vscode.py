@@ -0,0 +1,41 @@
+import functools
+
+from .facts import tool_path
+from .log import logger
+from .shell import bash
+
+@functools.lru_cache(maxsize=None)
+def installed_extensions():
+    # Every 'code' call starts the Electron CLI, which takes seconds, so the list is asked once. Returns {id: version}.
+    # When the CLI fails (like when run as root) nothing counts as installed, as with the other package managers
+    if tool_path('code') is None:
+        return {}
+    completed_process = bash('code --list-extensions --show-versions', check=False, capture=True)
+    if completed_process.returncode != 0:
+        return {}
+    extensions = {}
+    for line in completed_process.stdout.splitlines():
+        extension_id, _, version = line.strip().partition('@')
+        if extension_id:
+            extensions[extension_id.lower()] = version
+    return extensions
+
+def is_extension_installed(extension):
+    # Ids are not case sensitive. Accepts 'publisher.name' or 'publisher.name@version'
+    extension_id, _, version = extension.partition('@')
+    installed_version = installed_extensions().get(extension_id.lower())
+    if installed_version is None:
+        return False
+    return not version or installed_version == version
+
+def install_extensions(extensions):
+    # Installs every missing extension in a single 'code' call with one --install-extension per extension
+    extensions = [extension for extension in dict.fromkeys(extensions) if not is_extension_installed(extension)]
+    if not extensions:
+        logger.info('All VS Code extensions are already installed')
+        return
+
+    try:
+        bash(f"code {' '.join(f'--install-extension {extension}' for extension in extensions)}")
+    finally:
+        installed_extensions.cache_clear()
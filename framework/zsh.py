@@ -0,0 +1,47 @@
+import glob
+import os
+import shlex
+import statistics
+import tempfile
+import time
+
+from .log import logger
+from .paths import home_path
+from .shell import TIMEOUT_RETURN_CODE, bash
+
+# How many times zsh is started to measure its startup. The median is used, so a single slow start doesn't count
+startup_runs = 10
+startup_timeout_seconds = 60
+
+def zsh_startup_seconds(zshrc_text=None, runs=startup_runs):
+    # Measures 'zsh -i -c exit', which is what a new terminal waits for before showing the prompt. With zshrc_text,
+    # that content is measured instead of ~/.zshrc, from a temporary ZDOTDIR. The completion dumps of the home
+    # are linked there, so compinit doesn't rebuild them on every start and make it look slower than it is.
+    # Returns None when zsh doesn't start within the timeout
+    with tempfile.TemporaryDirectory() as zdotdir:
+        variables = ''
+        if zshrc_text is not None:
+            with open(os.path.join(zdotdir, '.zshrc'), 'w') as f:
+                f.write(zshrc_text)
+            for dump_path in glob.glob(os.path.join(home_path, '.zcompdump*')):
+                os.symlink(dump_path, os.path.join(zdotdir, os.path.basename(dump_path)))
+            variables = f'ZDOTDIR={shlex.quote(zdotdir)} '
+
+        durations = []
+        for _ in range(runs):
+            started_at = time.monotonic()
+            completed_process = bash(f'{variables}zsh -i -c exit >/dev/null 2>&1', check=False, timeout=startup_timeout_seconds)
+            if completed_process.returncode == TIMEOUT_RETURN_CODE:
+                logger.info(f'> zsh took more than {startup_timeout_seconds}s to start, so its startup was not measured')
+                return None
+            durations.append(time.monotonic() - started_at)
+    return statistics.median(durations)
+
+def is_zcompiled(path):
+    # zsh only uses the compiled '.zwc' when it is newer than the file
+    compiled_path = f'{path}.zwc'
+    return os.path.exists(compiled_path) and os.path.getmtime(compiled_path) >= os.path.getmtime(path)
+
+def zcompile(path):
+    bash(f"zsh -c {shlex.quote(f'zcompile {shlex.quote(path)}')}")
+    logger.info(f"Compiled '{path}'")
@@ -1 +1,3 @@
-# put here commands that should be executed only on this machine
\ No newline at end of file
+# put here commands that should be executed only on this machine
+# Lines for the shell of this machine can go in their own block of the .zshrc, which is kept when the ZSH step runs again:
+# managed_block(zshrc_path, 'local', 'export EDITOR=vim')